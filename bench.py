@@ -0,0 +1,498 @@
+# 离线压测工具
+# 不访问真实的 HOJ：fake-hoj 在本地模拟 data/api.yml 中的远程接口，seed 在独立目录中生成测试数据，
+# run 在该目录中启动假远程和 HOJOJ，执行压测场景并按路由输出 p50/p99 延迟和吞吐量。
+#
+#   python bench.py seed --root /tmp/hojbench --users 200 --submissions 20000
+#   python bench.py run --root /tmp/hojbench --scenario all
+#   python bench.py run --root /tmp/hojbench --save base.json      # 记录基线
+#   python bench.py run --root /tmp/hojbench --baseline base.json  # p99 退化超过阈值时返回非 0
+#
+# run 默认用 run.py serve（gunicorn 多进程）启动 HOJOJ，需要先 pip install gunicorn；
+# 没有安装时退回 Flask 开发服务器，只有一个进程，--workers 不生效，结果不能和生产模式的基线比较
+from flask import Flask, jsonify, request
+import yaml, os, sys, time, json, random, hashlib, itertools, threading, argparse, shutil, subprocess, signal, importlib.util
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_PASSWORD = 'bench'
+LANGUAGES = ['C++', 'C', 'Java', 'Python 3']
+# 生成历史评测记录时使用的最终状态
+FINAL_STATUS = [0, 0, 0, -1, -1, 1, 2, 3, -2]
+
+# 假远程
+# 实现 Login / updcfSession / submitProblem / GetSubmission / CheckSubmissionsStatus，
+# 每个请求先等待 latency 秒；提交在 judge 秒后变为 Accepted，之前为 Judging
+def create_fake_hoj(api, latency, judge):
+    app = Flask('fakehoj')
+    submit_ids = itertools.count(1000)
+    submissions = {}
+    calls = {}
+    lock = threading.Lock()
+
+    @app.before_request
+    def delay():
+        with lock:
+            calls[request.path] = calls.get(request.path, 0) + 1
+        if latency:
+            time.sleep(latency)
+
+    def authorized():
+        return bool(request.headers.get('Authorization'))
+
+    def view(submit_id):
+        created, payload = submissions[submit_id]
+        done = time.time() - created >= judge
+        return {
+            'submitId': submit_id,
+            'status': 0 if done else 7,
+            'time': 15,
+            'memory': 1024,
+            'score': 100 if done else None,
+            'language': payload.get('language'),
+            'code': payload.get('code')
+        }
+
+    @app.route(api['Login'], methods=['POST'])
+    def login():
+        response = jsonify({'status': 200, 'msg': 'success'})
+        # 请求头只能是 latin-1，token 取用户名的哈希
+        response.headers['Authorization'] = hashlib.md5(request.json['username'].encode('utf-8')).hexdigest()
+        return response
+
+    @app.route(api['updcfSession'], methods=['POST'])
+    def update_cf_session():
+        if not authorized():
+            return jsonify({'status': 401, 'msg': '请先登录'}), 401
+        return jsonify({'status': 200, 'msg': 'success'})
+
+    @app.route(api['submitProblem'], methods=['POST'])
+    def submit_problem():
+        if not authorized():
+            return jsonify({'status': 401, 'msg': '请先登录'}), 401
+        submit_id = next(submit_ids)
+        submissions[submit_id] = (time.time(), request.json)
+        return jsonify({'status': 200, 'data': {'submitId': submit_id}})
+
+    @app.route(api['GetSubmission'], methods=['GET'])
+    def get_submission():
+        submit_id = int(request.args['submitId'])
+        if submit_id not in submissions:
+            return jsonify({'status': 404, 'msg': '提交不存在'}), 404
+        return jsonify({'status': 200, 'data': {'submission': view(submit_id)}})
+
+    if 'CheckSubmissionsStatus' in api:
+        @app.route(api['CheckSubmissionsStatus'], methods=['POST'])
+        def check_submissions_status():
+            ids = [i for i in request.json['submitIds'] if i in submissions]
+            return jsonify({'status': 200, 'data': {str(i): view(i) for i in ids}})
+
+    @app.route('/bench/calls')
+    def get_calls():
+        with lock:
+            return jsonify(calls)
+
+    return app
+
+# 测试数据
+def _hash_password(password, iterations):
+    # 与 run.py 中的格式一致，迭代次数写在哈希里，压测数据用较少的迭代次数加快生成
+    salt = os.urandom(16).hex()
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('ascii'), iterations).hex()
+    return f'pbkdf2_sha256${iterations}${salt}${digest}'
+
+def seed(root, users, submissions, bots, remote, hash_iterations, source):
+    # 在 root 下准备一份独立的站点：复制程序、页面和题目，生成 data/ 中的用户、评测记录和远程账户
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    os.makedirs(os.path.join(root, 'data'))
+    os.makedirs(os.path.join(root, 'tmp'))
+    shutil.copy(os.path.join(source, 'run.py'), root)
+    for name in ('web', 'problem'):
+        shutil.copytree(os.path.join(source, name), os.path.join(root, name))
+    for name in ('api.yml', 'notice.yml'):
+        shutil.copy(os.path.join(source, 'data', name), os.path.join(root, 'data'))
+    with open(os.path.join(source, 'data', 'config.yml'), 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    config['remote_oj'] = remote
+    # 压测只连本地的假 HOJ
+    config.pop('remote_mirrors', None)
+    config['last_runid'] = submissions
+    config['last_uid'] = users + 1
+
+    pids = sorted(os.listdir(os.path.join(root, 'problem')))
+    names = [f'bench{i}' for i in range(users)]
+    stats = {name: {'try': 0, 'solve_list': []} for name in names}
+    records = []
+    start = time.time() - submissions * 60
+    for runid in range(1, submissions + 1):
+        author = random.choice(names)
+        pid = random.choice(pids)
+        status = random.choice(FINAL_STATUS)
+        stats[author]['try'] += 1
+        if status == 0 and pid not in stats[author]['solve_list']:
+            stats[author]['solve_list'].append(pid)
+        records.append({
+            'runid': runid,
+            'pid': pid,
+            'status': status,
+            'timems': random.randint(1, 1000),
+            'memorykb': random.randint(1000, 65536),
+            'author': author,
+            'language': random.choice(LANGUAGES),
+            'score': 100 if status == 0 else 0,
+            'code': f'// {author} {pid}\nint main() {{ return {runid % 97}; }}\n',
+            'createtime': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start + runid * 60))
+        })
+
+    hashed = _hash_password(BENCH_PASSWORD, hash_iterations)
+    user_list = [{'password': hashed, 'role': 'root', 'solve_list': [], 'solved': 0, 'try': 0, 'uid': 1, 'username': 'benchadmin'}]
+    for uid, name in enumerate(names, start=2):
+        user_list.append({
+            'password': hashed,
+            'role': 'user',
+            'solve_list': stats[name]['solve_list'],
+            'solved': len(stats[name]['solve_list']),
+            'try': stats[name]['try'],
+            'uid': uid,
+            'username': name
+        })
+
+    def dump(name, data):
+        with open(os.path.join(root, 'data', name), 'w', encoding='utf-8') as f:
+            yaml.dump(data, f, allow_unicode=True, sort_keys=False)
+
+    dump('config.yml', config)
+    dump('user.yml', user_list)
+    # 评测记录写成旧的 submission.yml，首次启动时由 run.py 导入日志
+    dump('submission.yml', records)
+    dump('botuser.yml', [{'username': f'bot{i}', 'password': 'bot'} for i in range(bots)])
+    # 示例比赛：从生成时开始持续 30 天，包含全部题目
+    dump('contest.yml', [{
+        'cid': 1,
+        'title': 'HOJOJ 示例赛',
+        'start': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()),
+        'end': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() + 30 * 86400)),
+        'rule': 'icpc',
+        'freeze': 60,
+        'problems': [int(pid) if pid.isdigit() else pid for pid in pids]
+    }])
+    with open(os.path.join(root, 'tmp', 'token.yml'), 'w', encoding='utf-8') as f:
+        f.write('[]\n')
+    print(f'已在 {root} 生成 {users} 个用户、{submissions} 条评测记录、{bots} 个远程账户')
+
+# 压测
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # 路由 -> [(延迟, 是否成功)]
+        self.samples = {}
+        # 路由 -> [第一个请求开始时间, 最后一个请求结束时间]，用于计算吞吐量
+        self.windows = {}
+        self.elapsed = {}
+
+    def record(self, route, seconds, ok):
+        now = time.time()
+        with self.lock:
+            self.samples.setdefault(route, []).append((seconds, ok))
+            window = self.windows.setdefault(route, [now - seconds, now])
+            window[1] = now
+
+    def timed(self, session, route, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=30, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        self.record(route, time.perf_counter() - start, ok)
+        return response
+
+def percentile(values, p):
+    # 最近秩法
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))]
+
+class Bench:
+    def __init__(self, base, root, concurrency, requests_per_scenario, submits, recorder):
+        self.base = base
+        self.root = root
+        self.concurrency = concurrency
+        self.count = requests_per_scenario
+        self.submits = submits
+        self.recorder = recorder
+        self.local = threading.local()
+        with open(os.path.join(root, 'data', 'user.yml'), 'r', encoding='utf-8') as f:
+            self.users = [user['username'] for user in yaml.safe_load(f) if user['role'] == 'user']
+        with open(os.path.join(root, 'data', 'config.yml'), 'r', encoding='utf-8') as f:
+            self.last_runid = yaml.safe_load(f).get('last_runid') or 1
+        self.pids = sorted(os.listdir(os.path.join(root, 'problem')))
+        self.tokens = {}
+
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def call(self, route, method, path, **kwargs):
+        return self.recorder.timed(self.session(), route, method, self.base + path, **kwargs)
+
+    def parallel(self, fn, items):
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            return list(executor.map(fn, items))
+
+    def login(self, username):
+        response = self.call('POST /api/login', 'POST', '/api/login', json={'username': username, 'password': BENCH_PASSWORD})
+        if response is not None and response.status_code == 200:
+            self.tokens[username] = response.headers['Authorization']
+
+    def contest_burst(self):
+        # 比赛开始：一批选手同时登录，随后集中提交，等待全部评测结束
+        # 提交按生产配置限速（每个远程 OJ、每个远程账户各一个令牌桶），出结果的总时间主要由限速决定
+        contestants = random.sample(self.users, min(len(self.users), self.concurrency * 2))
+        self.parallel(self.login, contestants)
+        contestants = [name for name in contestants if name in self.tokens]
+        if not contestants:
+            raise RuntimeError('选手登录全部失败')
+
+        def submit(i):
+            author = contestants[i % len(contestants)]
+            response = self.call('POST /api/submit-remote', 'POST', '/api/submit-remote', headers={'Authorization': self.tokens[author]},
+                                 json={'pid': random.choice(self.pids), 'lang': 'C++', 'code': f'int main() {{ return {i}; }}'})
+            if response is not None and response.status_code == 200:
+                return response.json().get('runid')
+            return None
+
+        start = time.time()
+        runids = [runid for runid in self.parallel(submit, range(self.submits)) if runid is not None]
+        # 全部提交得到最终结果的时间
+        pending = set(runids)
+        deadline = time.time() + 300
+        while pending and time.time() < deadline:
+            for runid in list(pending):
+                response = self.session().get(f'{self.base}/api/submission/{runid}', timeout=30)
+                if response.status_code == 200 and response.json()['status'] not in ('Submitting', 'Pending', 'Compiling', 'Judging'):
+                    pending.discard(runid)
+            time.sleep(0.5)
+        self.recorder.elapsed['contest-burst 全部出结果'] = time.time() - start
+        if pending:
+            print(f'警告: {len(pending)} 个提交在 300 秒内没有出结果')
+
+    def status_storm(self):
+        # 评测状态页被反复刷新：列表分页、按用户/题目过滤、游标翻页和详情
+        def refresh(i):
+            kind = i % 5
+            if kind == 0:
+                self.call('GET /status', 'GET', '/status')
+            elif kind == 1:
+                self.call('GET /api/submissions?page', 'GET', '/api/submissions', params={'count': 20, 'page': random.randint(1, 50)})
+            elif kind == 2:
+                self.call('GET /api/submissions?author', 'GET', '/api/submissions', params={'count': 20, 'author': random.choice(self.users)})
+            elif kind == 3:
+                response = self.call('GET /api/submissions?pid', 'GET', '/api/submissions', params={'count': 20, 'pid': random.choice(self.pids)})
+                cursor = response.headers.get('X-Next-Before') if response is not None else None
+                if cursor:
+                    self.call('GET /api/submissions?before', 'GET', '/api/submissions', params={'count': 20, 'before': cursor})
+            else:
+                self.call('GET /api/submission/<runid>', 'GET', f'/api/submission/{random.randint(1, self.last_runid)}')
+
+        self.parallel(refresh, range(self.count))
+
+    def status_watchers(self):
+        # 一批选手提交后都停在评测详情页：每个提交开两个 SSE 连接（超过 worker 线程数），
+        # 同时测量普通请求的延迟；推送连接已满时服务端返回 503，页面改为轮询
+        contestants = random.sample(self.users, min(len(self.users), self.concurrency))
+        self.parallel(self.login, contestants)
+        contestants = [name for name in contestants if name in self.tokens]
+        if not contestants:
+            raise RuntimeError('选手登录全部失败')
+
+        def submit(author):
+            response = self.call('POST /api/submit-remote', 'POST', '/api/submit-remote', headers={'Authorization': self.tokens[author]},
+                                 json={'pid': random.choice(self.pids), 'lang': 'C++', 'code': f'// {author}\nint main() {{ return 0; }}'})
+            if response is not None and response.status_code == 200:
+                return response.json().get('runid')
+            return None
+
+        runids = [runid for runid in self.parallel(submit, contestants) if runid is not None]
+
+        def watch(runid):
+            # 读到最终状态或服务端关闭连接为止
+            start = time.perf_counter()
+            try:
+                with requests.get(f'{self.base}/api/submission/{runid}/events', stream=True, timeout=60) as response:
+                    route = 'GET /api/submission/<runid>/events' + (' (503)' if response.status_code == 503 else '')
+                    for line in response.iter_lines(decode_unicode=True):
+                        if line.startswith('data:') and json.loads(line[5:])['status'] not in (5, 6, 7, 9):
+                            break
+                    ok = response.status_code in (200, 503)
+            except requests.RequestException:
+                route, ok = 'GET /api/submission/<runid>/events', False
+            self.recorder.record(route, time.perf_counter() - start, ok)
+
+        with ThreadPoolExecutor(len(runids) * 2 or 1) as watchers:
+            futures = [watchers.submit(watch, runid) for runid in runids * 2]
+            time.sleep(1)
+            self.parallel(lambda i: self.call('GET /api/about', 'GET', '/api/about'), range(self.count))
+            for future in futures:
+                future.result()
+
+    def profile_reads(self):
+        # 个人主页和排行榜
+        def read(i):
+            username = random.choice(self.users)
+            kind = i % 4
+            if kind == 0:
+                self.call('GET /user/<username>', 'GET', f'/user/{username}')
+            elif kind == 1:
+                self.call('GET /api/user/<username>', 'GET', f'/api/user/{username}')
+            elif kind == 2:
+                self.call('GET /api/ranklist', 'GET', '/api/ranklist', params={'count': 50, 'page': random.randint(1, 5)})
+            else:
+                self.call('GET /api/ranklist/<username>', 'GET', f'/api/ranklist/{username}')
+
+        self.parallel(read, range(self.count))
+
+SCENARIOS = {
+    'contest-burst': Bench.contest_burst,
+    'status-storm': Bench.status_storm,
+    'status-watchers': Bench.status_watchers,
+    'profile-reads': Bench.profile_reads
+}
+
+def report(recorder):
+    rows = {}
+    print(f'{"路由":<36}{"请求数":>8}{"失败":>6}{"p50(ms)":>10}{"p99(ms)":>10}{"req/s":>10}')
+    for route, samples in sorted(recorder.samples.items()):
+        latencies = [seconds for seconds, _ in samples]
+        failed = sum(1 for _, ok in samples if not ok)
+        first, last = recorder.windows[route]
+        row = {
+            'count': len(samples),
+            'failed': failed,
+            'p50': percentile(latencies, 50) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+            'rps': len(samples) / max(last - first, 1e-6)
+        }
+        rows[route] = row
+        print(f'{route:<36}{row["count"]:>8}{failed:>6}{row["p50"]:>10.1f}{row["p99"]:>10.1f}{row["rps"]:>10.1f}')
+    for name, seconds in recorder.elapsed.items():
+        print(f'{name}: {seconds:.1f}s')
+    return rows
+
+def compare(rows, baseline_path, threshold):
+    # p99 比基线慢 threshold 倍以上（且至少 5ms）视为退化
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = []
+    for route, row in rows.items():
+        base = baseline.get(route)
+        if base and row['p99'] > base['p99'] * threshold and row['p99'] - base['p99'] > 5:
+            regressions.append(f'{route}: p99 {base["p99"]:.1f}ms -> {row["p99"]:.1f}ms')
+    for line in regressions:
+        print('退化: ' + line)
+    return not regressions
+
+def wait_until_up(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} 没有启动')
+
+def run(args):
+    processes = []
+    try:
+        if args.target is None:
+            # 在 root 中启动假远程和 HOJOJ
+            processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), 'fake-hoj', '--root', args.root,
+                                               '--port', str(args.fake_port), '--latency', str(args.latency), '--judge', str(args.judge)],
+                                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True))
+            wait_until_up(f'http://127.0.0.1:{args.fake_port}/bench/calls')
+            log = open(os.path.join(args.root, 'bench_server.log'), 'w')
+            if importlib.util.find_spec('gunicorn') is not None:
+                command = ['serve', '--workers', str(args.workers), '--threads', str(args.threads)]
+            else:
+                print('未安装 gunicorn，改用 Flask 开发服务器压测（单进程，--workers 不生效），'
+                      '结果不能和生产模式比较；按生产模式压测请先 pip install gunicorn')
+                command = ['dev']
+            # 每个进程放在独立的进程组里，结束时连同开发服务器重载器启动的子进程一起停掉
+            processes.append(subprocess.Popen([sys.executable, 'run.py', *command, '--host', '127.0.0.1', '--port', str(args.port)],
+                                              cwd=args.root, stdout=log, stderr=subprocess.STDOUT, start_new_session=True))
+            base = f'http://127.0.0.1:{args.port}'
+            wait_until_up(base + '/api/about')
+        else:
+            base = args.target.rstrip('/')
+        recorder = Recorder()
+        bench = Bench(base, args.root, args.concurrency, args.requests, args.submits, recorder)
+        names = list(SCENARIOS) if args.scenario == 'all' else [args.scenario]
+        for name in names:
+            start = time.time()
+            SCENARIOS[name](bench)
+            print(f'{name} 完成，用时 {time.time() - start:.1f}s')
+        rows = report(recorder)
+        if args.save:
+            with open(args.save, 'w', encoding='utf-8') as f:
+                json.dump(rows, f, ensure_ascii=False, indent=2)
+        if args.baseline and not compare(rows, args.baseline, args.threshold):
+            return 1
+        return 0
+    finally:
+        for process in reversed(processes):
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            process.wait()
+
+def _source_dir():
+    return os.path.dirname(os.path.abspath(__file__))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HOJOJ 离线压测')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    fake = sub.add_parser('fake-hoj', help='启动本地假远程')
+    fake.add_argument('--root', default=_source_dir(), help='从 <root>/data/api.yml 读取接口路径')
+    fake.add_argument('--port', type=int, default=18080)
+    fake.add_argument('--latency', type=float, default=0.02, help='每个请求的延迟（秒）')
+    fake.add_argument('--judge', type=float, default=2, help='提交多久后出结果（秒）')
+
+    gen = sub.add_parser('seed', help='生成压测数据')
+    gen.add_argument('--root', required=True, help='压测站点目录，已存在时会被清空')
+    gen.add_argument('--users', type=int, default=200)
+    gen.add_argument('--submissions', type=int, default=20000)
+    gen.add_argument('--bots', type=int, default=20)
+    gen.add_argument('--remote', default='http://127.0.0.1:18080')
+    gen.add_argument('--hash-iterations', type=int, default=1000)
+
+    bench = sub.add_parser('run', help='执行压测场景')
+    bench.add_argument('--root', required=True, help='seed 生成的站点目录')
+    bench.add_argument('--scenario', default='all', choices=['all'] + list(SCENARIOS))
+    bench.add_argument('--concurrency', type=int, default=16)
+    bench.add_argument('--requests', type=int, default=500, help='status-storm / profile-reads 的请求数')
+    bench.add_argument('--submits', type=int, default=60, help='contest-burst 的提交数')
+    bench.add_argument('--target', help='压测已经运行的站点，不启动假远程和 HOJOJ')
+    bench.add_argument('--port', type=int, default=18090)
+    bench.add_argument('--workers', type=int, default=2)
+    bench.add_argument('--threads', type=int, default=16, help='每个 worker 的线程数')
+    bench.add_argument('--fake-port', type=int, default=18080)
+    bench.add_argument('--latency', type=float, default=0.02)
+    bench.add_argument('--judge', type=float, default=2)
+    bench.add_argument('--save', help='把结果保存为基线 JSON')
+    bench.add_argument('--baseline', help='与基线比较，p99 退化时返回 1')
+    bench.add_argument('--threshold', type=float, default=1.5)
+    args = parser.parse_args()
+
+    if args.command == 'fake-hoj':
+        with open(os.path.join(args.root, 'data', 'api.yml'), 'r', encoding='utf-8') as f:
+            api = yaml.safe_load(f)
+        create_fake_hoj(api, args.latency, args.judge).run(host='127.0.0.1', port=args.port, threaded=True)
+    elif args.command == 'seed':
+        seed(args.root, args.users, args.submissions, args.bots, args.remote, args.hash_iterations, _source_dir())
+    else:
+        sys.exit(run(args))
@@ -1,5 +1,19 @@
-from flask import Flask, jsonify, request, send_from_directory, redirect
-import yaml, os, uuid, datetime, requests, random, time, threading, hashlib
+from flask import Flask, jsonify, request, send_from_directory, redirect, abort, g
+from werkzeug.security import safe_join
+import yaml, os, uuid, datetime, requests, random, time, threading, hashlib, json, struct, bisect, heapq, itertools, sys, argparse, atexit, zlib, functools, gzip, mimetypes, hmac, collections, marshal, mmap, re, html, unicodedata, math
+from concurrent.futures import ThreadPoolExecutor
+from urllib3.exceptions import NewConnectionError
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+try:
+    import brotli
+except ImportError:
+    # 未安装 brotli 时只提供 gzip
+    brotli = None
 # Setting 
 with open('data/config.yml', encoding='utf-8') as f:
     config = yaml.safe_load(f)
@@ -42,6 +56,331 @@ common_headers = {
     "URL-Type": "general"
 }
 # Code
+# 跨进程文件锁，多进程部署时保护共享的数据文件
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+    def acquire(self, blocking=True):
+        if not self.local.acquire(blocking):
+            return False
+        if self.depth == 0:
+            if self.file is None:
+                self.file = open(self.path, 'a+b')
+            try:
+                _lock_file(self.file, blocking)
+            except OSError:
+                self.local.release()
+                return False
+        self.depth += 1
+        return True
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0:
+            _unlock_file(self.file)
+        self.local.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+if fcntl is not None:
+    def _lock_file(f, blocking):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+
+    def _unlock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+else:
+    def _lock_file(f, blocking):
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                if not blocking:
+                    raise
+                time.sleep(0.01)
+
+    def _unlock_file(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+# 指标
+# 计数器和耗时直方图先在本进程内累计，后台线程定期把快照写到 tmp/metrics/<pid>-<进程启动时间>.json，
+# /metrics 合并所有存活进程的快照后按 Prometheus 文本格式输出。进程退出后，它的计数器和直方图并入
+# tmp/metrics/retired.json 再删除快照，worker 重启时各 *_total 不会回退；文件名带启动时间，pid 被复用时
+# 不会把新进程当成旧进程。
+# metrics_sample_rate < 1 时只对一部分调用计时，观测值按 1/采样率 加权，总数仍是无偏估计
+METRICS_DIR = os.path.join('tmp', 'metrics')
+METRICS_FLUSH_INTERVAL = 5
+METRICS_RETIRED = 'retired.json'
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _metric_labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{k}="{escape(v)}"' for k, v in sorted(labels.items()))
+
+class _Timer:
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+class _NoTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_no_timer = _NoTimer()
+
+class Metrics:
+    def __init__(self, directory, sample_rate):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.weight = 1 / sample_rate if sample_rate > 0 else 0
+        self.lock = threading.Lock()
+        # (名称, 标签) -> 值
+        self.counters = {}
+        # (名称, 标签) -> [各桶计数..., 总和, 次数]
+        self.histograms = {}
+        # 名称 -> 导出时调用的函数，返回 None 表示本进程不报告
+        self.gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _metric_labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def timer(self, name, **labels):
+        # 未被采样时返回空计时器，不产生任何开销
+        return _Timer(self, name, labels) if self.sampled() else _no_timer
+
+    def observe(self, name, value, **labels):
+        key = (name, _metric_labels(labels))
+        i = bisect.bisect_left(METRICS_BUCKETS, value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(METRICS_BUCKETS) + 3)
+            # 只记在第一个不小于观测值的桶里，导出时再累加
+            histogram[i] += self.weight
+            histogram[-2] += value * self.weight
+            histogram[-1] += self.weight
+
+    def gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def snapshot(self):
+        gauges = {}
+        for name, fn in self.gauges.items():
+            try:
+                value = fn()
+            except Exception:
+                value = None
+            if value is not None:
+                gauges[name] = value
+        with self.lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, list(values)] for (name, labels), values in self.histograms.items()],
+                'gauges': [[name, '', value] for name, value in gauges.items()]
+            }
+
+    def _path(self):
+        pid = os.getpid()
+        return os.path.join(self.directory, f'{pid}-{_process_start(pid)}.json')
+
+    def flush(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path()
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def run(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f'写入指标快照失败: {e}')
+
+    def retire(self):
+        # 进程退出时写出最后的快照并并入 retired.json
+        try:
+            self.flush()
+            self._retire(self._path())
+        except Exception as e:
+            print(f'归档指标快照失败: {e}')
+
+    def _retire(self, path):
+        # 在锁内并入，多个进程同时收集时同一份快照只会被并入一次
+        retired_path = os.path.join(self.directory, METRICS_RETIRED)
+        with FileLock(os.path.join(self.directory, 'retired.lock')):
+            snapshot = self._load(path)
+            if snapshot is None:
+                self.remove_file(path)
+                return
+            retired = self._load(retired_path) or {'counters': [], 'histograms': []}
+            merged = {'counters': {}, 'histograms': {}, 'gauges': {}}
+            _merge_snapshot(merged, retired)
+            _merge_snapshot(merged, dict(snapshot, gauges=[]))
+            with open(retired_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump({
+                    'counters': [[name, labels, value] for (name, labels), value in merged['counters'].items()],
+                    'histograms': [[name, labels, values] for (name, labels), values in merged['histograms'].items()]
+                }, f)
+            os.replace(retired_path + '.tmp', retired_path)
+            self.remove_file(path)
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def collect(self):
+        # 合并已退出进程的累计值和所有存活进程的快照，已退出进程的快照先并入 retired.json
+        self.flush()
+        own = os.path.basename(self._path())
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json') or filename in (own, METRICS_RETIRED):
+                continue
+            pid, _, start = filename[:-5].partition('-')
+            try:
+                pid = int(pid)
+            except ValueError:
+                continue
+            if not _process_alive(pid) or _process_start(pid) != start:
+                self._retire(os.path.join(self.directory, filename))
+        merged = {'counters': {}, 'histograms': {}, 'gauges': {}}
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.json'):
+                snapshot = self._load(os.path.join(self.directory, filename))
+                if snapshot is not None:
+                    _merge_snapshot(merged, snapshot)
+        return merged
+
+    @staticmethod
+    def remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def render(self):
+        merged = self.collect()
+        lines = []
+        for kind, type_name in (('counters', 'counter'), ('gauges', 'gauge')):
+            for name in sorted({name for name, _ in merged[kind]}):
+                lines.append(f'# TYPE {name} {type_name}')
+                for (series, labels), value in sorted(merged[kind].items()):
+                    if series == name:
+                        lines.append(f'{name}{{{labels}}} {value:g}' if labels else f'{name} {value:g}')
+        for name in sorted({name for name, _ in merged['histograms']}):
+            lines.append(f'# TYPE {name} histogram')
+            for (series, labels), values in sorted(merged['histograms'].items()):
+                if series != name:
+                    continue
+                prefix = labels + ',' if labels else ''
+                cumulative = 0
+                for bound, count in zip(METRICS_BUCKETS + ('+Inf',), values):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative:g}')
+                suffix = f'{{{labels}}}' if labels else ''
+                lines.append(f'{name}_sum{suffix} {values[-2]:g}')
+                lines.append(f'{name}_count{suffix} {values[-1]:g}')
+        return '\n'.join(lines) + '\n'
+
+def _merge_snapshot(merged, snapshot):
+    for kind in ('counters', 'gauges'):
+        for name, labels, value in snapshot.get(kind, []):
+            merged[kind][(name, labels)] = merged[kind].get((name, labels), 0) + value
+    for name, labels, values in snapshot.get('histograms', []):
+        total = merged['histograms'].setdefault((name, labels), [0] * len(values))
+        for i, value in enumerate(values):
+            total[i] += value
+
+if os.name == 'nt':
+    import ctypes
+    from ctypes import wintypes
+    _kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    _kernel32.OpenProcess.argtypes = (wintypes.DWORD, wintypes.BOOL, wintypes.DWORD)
+    _kernel32.OpenProcess.restype = wintypes.HANDLE
+    _kernel32.GetExitCodeProcess.argtypes = (wintypes.HANDLE, ctypes.POINTER(wintypes.DWORD))
+    _kernel32.GetProcessTimes.argtypes = (wintypes.HANDLE,) + (ctypes.POINTER(wintypes.FILETIME),) * 4
+    _kernel32.CloseHandle.argtypes = (wintypes.HANDLE,)
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    STILL_ACTIVE = 259
+
+    def _windows_process_start(pid):
+        # Windows 上 os.kill(pid, 0) 会向进程发送 Ctrl+C，改用 OpenProcess 查询；
+        # 返回进程创建时间（FILETIME），进程不存在、已退出或无权访问时返回 None
+        handle = _kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return None
+        try:
+            code = wintypes.DWORD()
+            if not _kernel32.GetExitCodeProcess(handle, ctypes.byref(code)) or code.value != STILL_ACTIVE:
+                return None
+            times = [wintypes.FILETIME() for _ in range(4)]
+            if not _kernel32.GetProcessTimes(handle, *map(ctypes.byref, times)):
+                return None
+            return str(times[0].dwHighDateTime << 32 | times[0].dwLowDateTime)
+        finally:
+            _kernel32.CloseHandle(handle)
+
+def _process_start(pid):
+    # 进程启动时间（Linux 上为开机后的时钟周期数，Windows 上为创建时间），无法取得时为 0
+    if os.name == 'nt':
+        return _windows_process_start(pid) or '0'
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            stat = f.read()
+    except OSError:
+        return '0'
+    # 进程名可能含空格，从最后一个右括号之后开始数字段
+    return stat[stat.rindex(b')') + 2:].split()[19].decode('ascii')
+
+def _process_alive(pid):
+    if os.name == 'nt':
+        return _windows_process_start(pid) is not None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+metrics = Metrics(METRICS_DIR, config.get('metrics_sample_rate', 1))
+atexit.register(metrics.retire)
+
 def load_config():
     config_path = os.path.join(os.path.dirname(__file__), 'data', 'config.yml')
     try:
@@ -66,237 +405,3074 @@ def load_config():
             'cf_jsession': ''
         }
 
-def save_config(config):
-    config_path = os.path.join(os.path.dirname(__file__), 'data', 'config.yml')
-    with open(config_path, 'w', encoding='utf-8', newline='\n') as f:
-        yaml.dump(
-            {
-                'last_runid': config.get('last_runid', 0),
-                'remote_oj': config['remote_oj'],
-                'website_info': config['website_info'],
-                'cf_jsession': config['cf_jsession']
-            },
-            f,
-            allow_unicode=True,
-            default_flow_style=False,
-            sort_keys=False
-        )
+def atomic_dump_yaml(path, data, **kwargs):
+    # 先写临时文件再替换，写到一半崩溃也不会截断原文件
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with metrics.timer('hoj_yaml_dump_seconds', file=os.path.basename(path)):
+        with open(tmp_path, 'w', encoding='utf-8', newline='\n') as f:
+            yaml.dump(data, f, allow_unicode=True, **kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+def load_users():
+    user_file = os.path.join('data', 'user.yml')
+    if os.path.exists(user_file):
+        try:
+            with open(user_file, 'r', encoding='utf-8') as f:
+                return yaml.safe_load(f) or {}
+        except Exception as e:
+            print(f'读取用户文件失败: {e}')
+    return {}
+def save_users(users):
+    user_file = os.path.join('data', 'user.yml')
+    if os.path.exists(user_file):
+        try:
+            atomic_dump_yaml(user_file, users)
+        except Exception as e:
+            print(f'保存用户文件失败: {e}')
+            return False
+    return True
+
+
+# 生成token
+def generate_token(username):
+    token = str(uuid.uuid4())
+    # 设置token过期时间为7天
+    expire_date = datetime.datetime.now() + datetime.timedelta(days=7)
+    return token, expire_date
+
+# 加载token
+def load_tokens():
+    token_file = os.path.join('tmp', 'token.yml')
+
+    if os.path.exists(token_file):
+        try:
+            with open(token_file, 'r', encoding='utf-8') as f:
+                return yaml.safe_load(f) or []
+        except Exception as e:
+            print(f'读取token文件失败: {e}')
+    return []
+
+# 保存token
+def save_tokens(tokens):
+    token_file = os.path.join('tmp', 'token.yml')
+
+    try:
+        atomic_dump_yaml(token_file, tokens)
+        return True
+    except Exception as e:
+        print(f'保存token文件失败: {e}')
+        return False
+
+# 写回持久化
+# 修改先作用于内存模型并记录下来，由后台线程在 PERSIST_DELAY 秒内没有新修改（最长
+# PERSIST_MAX_DELAY 秒）后统一写盘，一批修改只写一次；写盘前若文件已被其他进程改写，
+# 则重新载入并重放尚未写盘的修改，避免互相覆盖；进程退出时保证写盘
+PERSIST_DELAY = 0.5
+PERSIST_MAX_DELAY = 2
+
+class Persistence:
+    def __init__(self):
+        self.cond = threading.Condition()
+        # collection -> (第一次修改时间, 最近一次修改时间)
+        self.dirty = {}
+
+    def mark_dirty(self, collection):
+        now = time.time()
+        with self.cond:
+            first, _ = self.dirty.get(collection, (now, now))
+            self.dirty[collection] = (first, now)
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    now = time.time()
+                    due = [c for c, (first, last) in self.dirty.items()
+                           if now - last >= PERSIST_DELAY or now - first >= PERSIST_MAX_DELAY]
+                    if due:
+                        break
+                    self.cond.wait(PERSIST_DELAY if self.dirty else None)
+                for c in due:
+                    del self.dirty[c]
+            for c in due:
+                self._flush(c)
+
+    def flush(self):
+        # 立即写出所有未写盘的修改
+        with self.cond:
+            due = list(self.dirty)
+            self.dirty.clear()
+        for c in due:
+            self._flush(c)
+
+    def _flush(self, collection):
+        try:
+            collection.flush()
+        except Exception as e:
+            print(f'写入 {collection.path} 失败: {e}')
+            self.mark_dirty(collection)
+
+persistence = Persistence()
+atexit.register(persistence.flush)
+
+# 二进制快照
+# data/snapshot.bin 缓存解析好的 user.yml、token.yml、botuser.yml、题目信息和评测记录的二级索引，
+# 冷启动时 mmap 读取目录，各部分在第一次用到时才反序列化；YAML 仍是可手工编辑、导入导出的格式，
+# 源文件的 (mtime, 大小) 与快照中记录的不一致时重新解析 YAML。快照每分钟和进程退出时由轮询进程写出。
+# 各部分只保存 dict/list/tuple/set/str/数字 等纯数据（marshal），读出后由使用方自己重建对象，
+# 快照文件被改写也不会执行任何代码；含有其他类型（如 YAML 中的日期）的部分不缓存。
+# 文件格式：
+#   头部  magic(8) 版本(u32) 目录长度(u32) 目录 crc32(u32)
+#   目录  每项 名称长度(u16) 名称 mtime_ns(i64) 大小(i64) 偏移(u64) 长度(u64) crc32(u32)
+#   数据  各部分的 marshal
+SNAPSHOT_FILE = os.path.join('data', 'snapshot.bin')
+SNAPSHOT_MAGIC = b'HOJSNAP\0'
+SNAPSHOT_VERSION = 3
+SNAPSHOT_INTERVAL = 60
+_SNAPSHOT_HEADER = struct.Struct('<8sIII')
+_SNAPSHOT_ENTRY = struct.Struct('<qqQQI')
+
+def file_fingerprint(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+class SnapshotStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # 名称 -> (指纹, 数据 bytes 或 mmap 中的 (偏移, 长度), crc32)
+        self.sections = {}
+        # 停机或定时保存时调用的函数：名称 -> fn()
+        self.providers = {}
+        self.map = None
+        self.dirty = False
+        self._open()
+
+    def _open(self):
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            return
+        with f:
+            try:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # 空文件
+                return
+        try:
+            magic, version, table_size, table_crc = _SNAPSHOT_HEADER.unpack_from(self.map, 0)
+            table = self.map[_SNAPSHOT_HEADER.size:_SNAPSHOT_HEADER.size + table_size]
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or zlib.crc32(table) != table_crc:
+                raise ValueError('快照版本不匹配或已损坏')
+            pos = 0
+            while pos < len(table):
+                (name_size,) = struct.unpack_from('<H', table, pos)
+                name = table[pos + 2:pos + 2 + name_size].decode('utf-8')
+                pos += 2 + name_size
+                mtime_ns, size, offset, length, crc = _SNAPSHOT_ENTRY.unpack_from(table, pos)
+                pos += _SNAPSHOT_ENTRY.size
+                fingerprint = None if mtime_ns < 0 else (mtime_ns, size)
+                self.sections[name] = (fingerprint, (offset, length), crc)
+        except (struct.error, ValueError, UnicodeDecodeError) as e:
+            print(f'忽略快照 {self.path}: {e}')
+            self.sections = {}
+            self.map.close()
+            self.map = None
+
+    def _raw(self, stored):
+        if isinstance(stored, bytes):
+            return stored
+        offset, length = stored
+        return self.map[offset:offset + length]
+
+    def get(self, name, fingerprint=None):
+        # 指纹一致且校验通过时返回新反序列化的数据，否则返回 None
+        with self.lock:
+            section = self.sections.get(name)
+            if section is None or section[0] != fingerprint:
+                return None
+            raw = self._raw(section[1])
+        if zlib.crc32(raw) != section[2]:
+            print(f'快照中的 {name} 校验失败')
+            return None
+        try:
+            return marshal.loads(raw)
+        except (EOFError, ValueError, TypeError):
+            print(f'快照中的 {name} 无法读取')
+            return None
+
+    def put(self, name, data, fingerprint=None):
+        try:
+            raw = marshal.dumps(data)
+        except ValueError:
+            # 不是纯数据，不缓存
+            return
+        with self.lock:
+            self.sections[name] = (fingerprint, raw, zlib.crc32(raw))
+            self.dirty = True
+
+    def load_yaml(self, path, loader):
+        # 源文件未变化时直接使用快照中解析好的结果
+        fingerprint = file_fingerprint(path)
+        if fingerprint is not None:
+            data = self.get(path, fingerprint)
+            if data is not None:
+                return data
+        data = loader()
+        if fingerprint is not None and fingerprint == file_fingerprint(path):
+            self.put(path, data, fingerprint)
+        return data
+
+    def provide(self, name, fn):
+        # fn 在保存快照前调用，自行持有需要的锁并调用 put
+        self.providers[name] = fn
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            sections = [(name, fingerprint, self._raw(stored), crc) for name, (fingerprint, stored, crc) in self.sections.items()]
+            # 数据都已复制出来，关闭映射，Windows 上才能替换文件
+            self.sections = {name: (fingerprint, raw, crc) for name, fingerprint, raw, crc in sections}
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+        names = [name.encode('utf-8') for name, _, _, _ in sections]
+        offset = _SNAPSHOT_HEADER.size + sum(2 + len(name) + _SNAPSHOT_ENTRY.size for name in names)
+        table = []
+        for encoded, (_, fingerprint, raw, crc) in zip(names, sections):
+            mtime_ns, size = fingerprint if fingerprint is not None else (-1, 0)
+            table.append(struct.pack('<H', len(encoded)) + encoded + _SNAPSHOT_ENTRY.pack(mtime_ns, size, offset, len(raw), crc))
+            offset += len(raw)
+        table = b''.join(table)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(table), zlib.crc32(table)))
+            f.write(table)
+            for _, _, raw, _ in sections:
+                f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def save(self):
+        # 先写完 YAML（同时更新对应的快照部分），再收集各 provider 的当前状态，有变化时写出快照。
+        # 各进程的数据相同，只由轮询进程写快照，避免多个 worker 互相覆盖
+        persistence.flush()
+        if not is_poller:
+            return
+        for name, fn in list(self.providers.items()):
+            try:
+                fn()
+            except Exception as e:
+                print(f'生成快照 {name} 失败: {e}')
+        try:
+            self.flush()
+        except Exception as e:
+            print(f'写入快照失败: {e}')
+
+    def run(self):
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL)
+            self.save()
+
+snapshots = SnapshotStore(SNAPSHOT_FILE)
+atexit.register(snapshots.save)
+
+class YamlCollection:
+    # 子类实现 read()/build()/dump()，loaded() 在重新载入后重建派生索引
+    def __init__(self, path, lock_path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.file_lock = FileLock(lock_path)
+        self.pending = []
+        self.mtime = None
+        self.checked = 0
+        self._load()
+
+    def loaded(self):
+        pass
+
+    def _file_mtime(self):
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def _read(self):
+        with metrics.timer('hoj_yaml_load_seconds', file=os.path.basename(self.path)):
+            return snapshots.load_yaml(self.path, self.read)
+
+    def _load(self):
+        self.mtime = self._file_mtime()
+        self.data = self.build(self._read())
+        self.loaded()
+
+    def reload_if_changed(self, interval=0):
+        # 每 interval 秒最多检查一次文件是否被其他进程改写；有未写盘的修改时等写盘时合并
+        now = time.time()
+        if now - self.checked < interval:
+            return
+        self.checked = now
+        with self.lock:
+            if not self.pending and self._file_mtime() != self.mtime:
+                self._load()
+
+    def apply(self, op):
+        # op(data) 直接修改内存模型，写盘时如有需要会在最新文件内容上重放
+        with self.lock:
+            result = op(self.data)
+            self.pending.append(op)
+        persistence.mark_dirty(self)
+        return result
+
+    def flush(self):
+        with self.lock, self.file_lock:
+            if not self.pending:
+                return
+            if self._file_mtime() != self.mtime:
+                data = self.build(self._read())
+                for op in self.pending:
+                    op(data)
+                self.data = data
+                self.loaded()
+            dumped = self.dump(self.data)
+            atomic_dump_yaml(self.path, dumped)
+            self.mtime = self._file_mtime()
+            self.pending = []
+            # 刚写出的内容同时更新到快照，下次启动不必重新解析
+            snapshots.put(self.path, dumped, file_fingerprint(self.path))
+
+# token 缓存：token -> {username, role, expire, expire_date}
+# expire 为预先计算好的时间戳，过期 token 由后台线程定期清理，只在登录/登出时写盘
+TOKEN_SWEEP_INTERVAL = 60
+TOKEN_RELOAD_INTERVAL = 1
+
+class TokenStore(YamlCollection):
+    def __init__(self):
+        super().__init__(os.path.join('tmp', 'token.yml'), os.path.join('tmp', 'token.lock'))
+
+    def read(self):
+        return load_tokens()
+
+    def build(self, raw):
+        tokens = {}
+        now = time.time()
+        for t in raw:
+            expire = datetime.datetime.strptime(t['expire_date'], '%Y-%m-%d %H:%M:%S').timestamp()
+            if expire > now:
+                tokens[t['token']] = dict(t, expire=expire)
+        return tokens
+
+    def dump(self, tokens):
+        return [{k: v for k, v in t.items() if k != 'expire'} for t in tokens.values()]
+
+    def get(self, token):
+        entry = self.data.get(token)
+        # 未命中时立即、否则每 TOKEN_RELOAD_INTERVAL 秒检查一次其他进程的登录/登出
+        self.reload_if_changed(0 if entry is None else TOKEN_RELOAD_INTERVAL)
+        entry = self.data.get(token)
+        if entry is None or entry['expire'] <= time.time():
+            return None
+        return entry
+
+    def issue(self, username, role):
+        token, expire_date = generate_token(username)
+        entry = {
+            'token': token,
+            'expire_date': expire_date.strftime('%Y-%m-%d %H:%M:%S'),
+            'username': username,
+            'role': role,
+            'expire': expire_date.timestamp()
+        }
+
+        def op(tokens):
+            # 移除该用户现有的token（如果有）
+            for k in [k for k, v in tokens.items() if v['username'] == username]:
+                del tokens[k]
+            tokens[token] = dict(entry)
+
+        self.reload_if_changed()
+        self.apply(op)
+        # 新 token 要立即对其他进程可见，不等待延迟写盘
+        try:
+            self.flush()
+        except Exception as e:
+            print(f'保存token文件失败: {e}')
+            return None, expire_date
+        return token, expire_date
+
+    def revoke(self, token):
+        self.reload_if_changed()
+        if token not in self.data:
+            return False
+        self.apply(lambda tokens: tokens.pop(token, None))
+        self.flush()
+        return True
+
+    def sweep(self):
+        # 过期 token 只从内存中移除，下次写盘时自然不会写出
+        now = time.time()
+        with self.lock:
+            expired = [k for k, v in self.data.items() if v['expire'] <= now]
+            for k in expired:
+                del self.data[k]
+        return len(expired)
+
+token_store = TokenStore()
+
+def sweep_tokens():
+    while True:
+        time.sleep(TOKEN_SWEEP_INTERVAL)
+        token_store.sweep()
+
+# 验证token
+def validate_token(token):
+    entry = token_store.get(token)
+    if entry is None:
+        return False, None, None
+    return True, entry['username'], entry['role']
+
+# 评测记录存储
+# data/submission.log 为追加写日志，每条记录占一行：
+#   定长头部（status timems memorykb score，可原地改写） + JSON 正文（其余字段，代码只记 code_hash）
+# data/submission.idx 为 runid→偏移 的索引，每项 16 字节 (runid, offset)
+SUBMISSION_LOG = os.path.join('data', 'submission.log')
+SUBMISSION_IDX = os.path.join('data', 'submission.idx')
+SUBMISSION_YML = os.path.join('data', 'submission.yml')
+_HEADER_FIELDS = (('status', 4), ('timems', 10), ('memorykb', 10), ('score', 6))
+_HEADER_SIZE = sum(width + 1 for _, width in _HEADER_FIELDS)
+_HEADER_KEYS = {key for key, _ in _HEADER_FIELDS}
+_INDEX_ENTRY = struct.Struct('<qQ')
+# 内存中的二级索引：字段 -> 值 -> 升序 runid 列表，值统一按字符串比较
+_QUERY_FIELDS = ('author', 'pid', 'language', 'status', 'cid')
+
+def _query_value(record, field):
+    # language 按用户提交时选择的本站语言索引，旧记录只有转换后的远程语言
+    if field == 'language':
+        return str(record.get('submit_language', record.get('language')))
+    return str(record.get(field))
+
+def _intersect_desc(postings, before, count, skip):
+    # 从 before 开始倒序求若干升序 runid 列表的交集，每一步在各列表上二分跳到不大于当前候选的位置，
+    # 代价与返回条数和跳跃次数相关，与列表长度无关
+    bound = before
+    result = []
+    while len(result) < count + skip:
+        first = postings[0]
+        i = len(first) if bound is None else bisect.bisect_left(first, bound)
+        if i == 0:
+            break
+        candidate = first[i - 1]
+        agreed = False
+        while not agreed:
+            agreed = True
+            for runids in postings:
+                j = bisect.bisect_right(runids, candidate)
+                if j == 0:
+                    return result[skip:]
+                if runids[j - 1] != candidate:
+                    candidate = runids[j - 1]
+                    agreed = False
+        result.append(candidate)
+        bound = candidate
+    return result[skip:]
+
+def _pack_header(record):
+    parts = []
+    for key, width in _HEADER_FIELDS:
+        value = record.get(key)
+        text = '' if value is None else str(int(value))
+        if len(text) > width:
+            raise ValueError(f'{key} 超出存储宽度: {value}')
+        parts.append(text.rjust(width))
+    return (' '.join(parts) + ' ').encode('ascii')
+
+def _unpack_header(raw):
+    record = {}
+    pos = 0
+    for key, width in _HEADER_FIELDS:
+        text = raw[pos:pos + width].strip()
+        record[key] = int(text) if text else None
+        pos += width + 1
+    return record
+
+# 代码按内容寻址单独存放：data/code/<sha256 前两位>/<sha256>.zz（zlib 压缩），
+# 相同代码只存一份；日志正文只记 code_hash，列表接口不再读取和传输代码
+CODE_DIR = os.path.join('data', 'code')
+CODE_CACHE_SIZE = 256
+
+class CodeBlobStore:
+    def __init__(self, root):
+        self.root = root
+        # 每个实例各自的 LRU 缓存
+        self.get = functools.lru_cache(maxsize=CODE_CACHE_SIZE)(self._load)
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest + '.zz')
+
+    def put(self, code):
+        raw = code.encode('utf-8')
+        digest = hashlib.sha256(raw).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.compress(raw))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        return digest
+
+    def _load(self, digest):
+        with open(self._path(digest), 'rb') as f:
+            return zlib.decompress(f.read()).decode('utf-8')
+
+class SubmissionStore:
+    def __init__(self, log_path, index_path, lock_path, blobs):
+        self.log_path = log_path
+        self.index_path = index_path
+        self.blobs = blobs
+        self.lock = threading.RLock()
+        # 多进程部署时，追加写入需要持有跨进程锁
+        self.file_lock = FileLock(lock_path)
+        # runid -> 记录在日志中的偏移
+        self.index = {}
+        # 按 runid 升序排列，分页时从尾部取
+        self.runids = []
+        # 已读入的索引文件长度
+        self.index_pos = 0
+        self.postings = {field: {} for field in _QUERY_FIELDS}
+        # runid -> 已索引的各字段值
+        self.indexed = {}
+        # 其他进程追加、还没读出字段建立二级索引的 runid，第一次按字段查询时再读
+        self.unindexed = []
+        # 状态还可能被其他进程原地改写的 runid
+        self.unsettled = set()
+        self._open()
+
+    def _open(self):
+        for path in (self.log_path, self.index_path):
+            if not os.path.exists(path):
+                open(path, 'ab').close()
+        # 不使用缓冲，保证能读到其他进程原地改写的状态
+        self.log = open(self.log_path, 'r+b', buffering=0)
+        self.idx = open(self.index_path, 'r+b', buffering=0)
+        with self.lock, self.file_lock:
+            self._restore()
+            self._refresh()
+            self._recover()
+
+    def _restore(self):
+        # 快照中的索引覆盖 submission.idx 的前 index_pos 字节；这部分没有变化时直接使用，
+        # 之后追加的索引项由 _refresh 照常读入。状态未结束的记录在 unsettled 中，查询前会重新读取
+        state = snapshots.get('submissions')
+        if state is None or state.get('fields') != _QUERY_FIELDS:
+            return
+        if os.fstat(self.idx.fileno()).st_size < state['index_pos']:
+            return
+        self.idx.seek(0)
+        raw = self.idx.read(state['index_pos'])
+        if zlib.crc32(raw) != state['index_crc']:
+            return
+        for runid, offset in _INDEX_ENTRY.iter_unpack(raw):
+            self.index[runid] = offset
+        self.runids = sorted(self.index)
+        self.postings = state['postings']
+        self.indexed = state['indexed']
+        self.unsettled = state['unsettled']
+        self.index_pos = state['index_pos']
+
+    def snapshot(self):
+        # 在锁内序列化，避免写入线程同时修改索引
+        with self.lock:
+            self._refresh()
+            self._index_pending()
+            self.idx.seek(0)
+            raw = self.idx.read(self.index_pos)
+            snapshots.put('submissions', {
+                'index_pos': self.index_pos,
+                'index_crc': zlib.crc32(raw),
+                'fields': _QUERY_FIELDS,
+                'postings': self.postings,
+                'indexed': self.indexed,
+                'unsettled': self.unsettled
+            })
+
+    def _remember(self, runid, offset, record=None):
+        if runid not in self.index:
+            bisect.insort(self.runids, runid)
+        self.index[runid] = offset
+        if record is not None:
+            self._index_fields(runid, record)
+        else:
+            self.unindexed.append(runid)
+
+    def _index_pending(self):
+        # 读出延后索引的记录；启动时只读入 runid→偏移，不必解析全部历史记录
+        for runid in self.unindexed:
+            self._index_fields(runid, self._read(self.index[runid]))
+        self.unindexed = []
+
+    def _index_fields(self, runid, record):
+        values = tuple(_query_value(record, field) for field in _QUERY_FIELDS)
+        old = self.indexed.get(runid)
+        if values != old:
+            for i, field in enumerate(_QUERY_FIELDS):
+                if old is not None and old[i] != values[i]:
+                    postings = self.postings[field][old[i]]
+                    del postings[bisect.bisect_left(postings, runid)]
+                if old is None or old[i] != values[i]:
+                    bisect.insort(self.postings[field].setdefault(values[i], []), runid)
+            self.indexed[runid] = values
+        if record.get('status') in (5,6,7,9):
+            self.unsettled.add(runid)
+        else:
+            self.unsettled.discard(runid)
+
+    def _settle(self):
+        # 按状态过滤前，重新读取未结束提交的头部，同步其他进程改写的状态
+        for runid in list(self.unsettled):
+            self.log.seek(self.index[runid])
+            header = _unpack_header(self.log.read(_HEADER_SIZE))
+            self._index_fields(runid, dict(zip(_QUERY_FIELDS, self.indexed[runid]), status=header['status']))
+
+    def _refresh(self):
+        # 读入其他进程追加的索引项，未写完整的索引项留到下次
+        size = os.fstat(self.idx.fileno()).st_size
+        usable = size - (size - self.index_pos) % _INDEX_ENTRY.size
+        if usable <= self.index_pos:
+            return
+        self.idx.seek(self.index_pos)
+        raw = self.idx.read(usable - self.index_pos)
+        for runid, offset in _INDEX_ENTRY.iter_unpack(raw):
+            self._remember(runid, offset)
+        self.index_pos = usable
+
+    def _recover(self):
+        # 上次可能在写完日志、未写索引时退出：丢弃残缺的索引项，补齐最后一条已索引记录之后的索引
+        self.idx.truncate(self.index_pos)
+        end = 0
+        if self.index:
+            last = max(self.index.values())
+            end = last + len(self._readline(last))
+        if end >= os.fstat(self.log.fileno()).st_size:
+            return
+        with open(self.log_path, 'rb') as f:
+            f.seek(end)
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    break
+                self._index_record(json.loads(line[_HEADER_SIZE:])['runid'], offset)
+        # 截掉写了一半的记录
+        self.log.truncate(f.tell() if line.endswith(b'\n') else offset)
+
+    def _index_record(self, runid, offset, record=None):
+        self.idx.seek(self.index_pos)
+        self.idx.write(_INDEX_ENTRY.pack(runid, offset))
+        self.index_pos += _INDEX_ENTRY.size
+        self._remember(runid, offset, record)
+
+    def _readline(self, offset):
+        self.log.seek(offset)
+        chunks = []
+        while True:
+            chunk = self.log.read(8192)
+            if not chunk:
+                break
+            end = chunk.find(b'\n')
+            if end >= 0:
+                chunks.append(chunk[:end + 1])
+                break
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def _read(self, offset):
+        line = self._readline(offset)
+        record = json.loads(line[_HEADER_SIZE:])
+        record.update(_unpack_header(line[:_HEADER_SIZE]))
+        return record
+
+    def _write(self, record):
+        # 调用方需持有 self.lock 和 self.file_lock
+        self._refresh()
+        body = {k: v for k, v in record.items() if k not in _HEADER_KEYS}
+        if 'code' in body:
+            # 先写代码再写引用它的记录
+            body['code_hash'] = self.blobs.put(body.pop('code'))
+        line = _pack_header(record) + json.dumps(body, ensure_ascii=False).encode('utf-8') + b'\n'
+        offset = self.log.seek(0, os.SEEK_END)
+        self.log.write(line)
+        self._index_record(record['runid'], offset, record)
+        return offset
+
+    def __len__(self):
+        with self.lock:
+            self._refresh()
+            return len(self.runids)
+
+    def exists(self, runid):
+        with self.lock:
+            self._refresh()
+            return runid in self.index
+
+    def get(self, runid, code=False):
+        # 默认只返回元数据，code=True 时才读取代码
+        with self.lock:
+            self._refresh()
+            offset = self.index.get(runid)
+            if offset is None:
+                return None
+            record = self._read(offset)
+        return self._load_code(record) if code else self._strip_code(record)
+
+    def _strip_code(self, record):
+        # 旧格式的记录正文里直接带着代码
+        record.pop('code', None)
+        return record
+
+    def _load_code(self, record):
+        digest = record.pop('code_hash', None)
+        if digest is not None:
+            record['code'] = self.blobs.get(digest)
+        return record
+
+    def append(self, record):
+        with self.lock, self.file_lock:
+            self._refresh()
+            if record['runid'] in self.index:
+                raise KeyError(f'runid {record["runid"]} 已存在')
+            return self._write(record)
+
+    def _update(self, runid, fields):
+        offset = self.index.get(runid)
+        if offset is None:
+            raise KeyError(f'runid {runid} 不存在')
+        record = self._read(offset)
+        in_place = all(k in _HEADER_KEYS or record.get(k) == v for k, v in fields.items())
+        record.update(fields)
+        if in_place:
+            # 只改动了头部字段：原地改写
+            self.log.seek(offset)
+            self.log.write(_pack_header(record))
+            self._index_fields(runid, record)
+        else:
+            # 正文有变化：追加新版本并让索引指向它
+            self._write(record)
+        return record
+
+    def update(self, runid, fields):
+        return self.update_many({runid: fields})[runid]
+
+    def update_many(self, updates):
+        # 一批更新只加一次锁
+        with self.lock, self.file_lock:
+            self._refresh()
+            return {runid: self._update(runid, fields) for runid, fields in updates.items()}
+
+    def scan(self):
+        # 按 runid 升序遍历全部记录
+        with self.lock:
+            self._refresh()
+            runids = list(self.runids)
+        for runid in runids:
+            yield self.get(runid)
+
+    def query(self, filters, before=None, count=10, skip=0):
+        # 最新的在前，返回满足 filters（字段 -> 字符串值）且 runid < before 的记录，跳过前 skip 条
+        # 有过滤条件时对各字段的 runid 列表求交集，只读取返回的记录
+        with self.lock:
+            self._refresh()
+            if not filters:
+                i = len(self.runids) if before is None else bisect.bisect_left(self.runids, before)
+                runids = self.runids[max(i - skip - count, 0):max(i - skip, 0)][::-1]
+            else:
+                self._index_pending()
+                if 'status' in filters:
+                    self._settle()
+                postings = sorted((self.postings[field].get(value, []) for field, value in filters.items()), key=len)
+                runids = _intersect_desc(postings, before, count, skip)
+            return [self._strip_code(self._read(self.index[runid])) for runid in runids]
+
+    def migrate_from_yaml(self, yaml_path):
+        # 一次性从旧的 submission.yml 导入，按 runid 升序写入日志
+        with open(yaml_path, 'r', encoding='utf-8') as f:
+            submissions = yaml.safe_load(f) or []
+        with self.lock, self.file_lock:
+            self._refresh()
+            if self.runids:
+                return 0
+            for sub in sorted(submissions, key=lambda s: s['runid']):
+                if sub['runid'] not in self.index:
+                    self._write(sub)
+        return len(submissions)
+
+def open_submission_store():
+    store = SubmissionStore(SUBMISSION_LOG, SUBMISSION_IDX, os.path.join('tmp', 'submission.lock'), CodeBlobStore(CODE_DIR))
+    if not len(store) and os.path.exists(SUBMISSION_YML):
+        count = store.migrate_from_yaml(SUBMISSION_YML)
+        if count:
+            print(f'已从 {SUBMISSION_YML} 迁移 {count} 条评测记录')
+    return store
+
+submission_store = open_submission_store()
+snapshots.provide('submissions', submission_store.snapshot)
+
+# 题目目录
+# 启动时一次性读取 problem/*/information.yml，后台线程按 mtime 只刷新变化的题目，
+# /api/problems 的 JSON 预先序列化并带上 ETag
+PROBLEM_DIR = os.path.join(os.path.dirname(__file__), 'problem')
+PROBLEM_WATCH_INTERVAL = 2
+
+def load_problem_info(info_file_path):
+    def parse():
+        with open(info_file_path, 'r', encoding='utf-8') as f, metrics.timer('hoj_yaml_load_seconds', file='information.yml'):
+            # 解析YAML文件
+            return yaml.safe_load(f)
+    info_data = snapshots.load_yaml(info_file_path, parse)
+    # 提取题目信息
+    problem_info = {}
+    for entry in info_data:
+        for key, value in entry.items():
+            problem_info[key] = value
+    return problem_info
+
+class ProblemCatalog:
+    def __init__(self, problem_dir):
+        self.problem_dir = problem_dir
+        self.lock = threading.Lock()
+        # pid -> 题目信息
+        self.problems = {}
+        self.mtimes = {}
+        self.listing = b'[]'
+        self.etag = None
+        self.refresh()
+
+    def get(self, pid):
+        return self.problems.get(str(pid))
+
+    def refresh(self):
+        # 只重新解析 mtime 变化的 information.yml，返回发生变化的 pid
+        seen = {}
+        for item in os.listdir(self.problem_dir):
+            info_file_path = os.path.join(self.problem_dir, item, 'information.yml')
+            try:
+                seen[item] = os.stat(info_file_path).st_mtime_ns
+            except OSError:
+                continue
+        changed = [pid for pid, mtime in seen.items() if self.mtimes.get(pid) != mtime]
+        removed = [pid for pid in self.mtimes if pid not in seen]
+        if not changed and not removed:
+            return []
+        with self.lock:
+            problems = dict(self.problems)
+            for pid in removed:
+                problems.pop(pid, None)
+                self.mtimes.pop(pid, None)
+            for pid in changed:
+                # 解析失败时保留旧数据，等文件再次修改后重试
+                self.mtimes[pid] = seen[pid]
+                try:
+                    problem_info = load_problem_info(os.path.join(self.problem_dir, pid, 'information.yml'))
+                except Exception as e:
+                    print(f'读取题目 {pid} 失败: {e}')
+                    continue
+                problem_info.setdefault('id', pid)
+                problems[pid] = problem_info
+            self.problems = problems
+            self._serialize()
+        return changed + removed
+
+    def _serialize(self):
+        problems = [{
+            'id': str(info['id']),
+            'title': info.get('name', f'题目 {pid}'),
+            'diff': info.get('diff', '--')
+        } for pid, info in self.problems.items()]
+        # 按题号排序
+        problems.sort(key=lambda x: int(x['id']))
+        self.listing = json.dumps(problems, ensure_ascii=False).encode('utf-8')
+        self.etag = hashlib.md5(self.listing).hexdigest()
+
+    def watch(self):
+        while True:
+            time.sleep(PROBLEM_WATCH_INTERVAL)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f'刷新题目目录失败: {e}')
+
+problem_catalog = ProblemCatalog(PROBLEM_DIR)
+
+# 题目搜索
+# 倒排索引：词 -> {pid: 权重}，词来自题目名称和 info.html 去掉标签后的正文。
+# 中文按单字和相邻两字切分，英文和数字按整词切分；查询要求命中全部查询词，按 TF-IDF 排序，标题命中权重更高。
+# 启动时从快照恢复文件未变化的题目，后台线程按 mtime 只重新切分变化的题目
+SEARCH_TITLE_WEIGHT = 5
+SEARCH_SECTION_RE = re.compile(r'(?is)<section id="problem-details".*?</section>')
+SEARCH_STRIP_RE = re.compile(r'(?is)<(script|style|head|button)\b.*?</\1>|<!--.*?-->')
+SEARCH_TAG_RE = re.compile(r'<[^>]+>')
+SEARCH_WORD_RE = re.compile(r'[0-9a-z]+|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+
+def search_tokens(text, query=False):
+    # 查询时中文只用两字词（单个字除外），索引时单字和两字词都收录
+    text = unicodedata.normalize('NFKC', text).lower()
+    tokens = []
+    for word in SEARCH_WORD_RE.findall(text):
+        if word.isascii():
+            tokens.append(word)
+            continue
+        if not query or len(word) == 1:
+            tokens.extend(word)
+        tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+def problem_text(path):
+    # 只取题目详情部分，去掉脚本、注释和标签
+    with open(path, 'r', encoding='utf-8') as f:
+        page = f.read()
+    section = SEARCH_SECTION_RE.search(page)
+    if section:
+        page = section.group(0)
+    page = SEARCH_STRIP_RE.sub(' ', page)
+    return html.unescape(SEARCH_TAG_RE.sub(' ', page))
+
+class ProblemSearch:
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.lock = threading.Lock()
+        # pid -> (文件指纹, {词: 权重})
+        self.docs = {}
+        self.postings = {}
+        self._restore()
+        self.refresh()
+
+    def _restore(self):
+        state = snapshots.get('problem_search')
+        if state is None:
+            return
+        for pid, (fingerprint, weights) in state.items():
+            if self.catalog.get(pid) is not None and fingerprint == self._fingerprint(pid):
+                self._add(pid, fingerprint, weights)
+
+    def snapshot(self):
+        with self.lock:
+            snapshots.put('problem_search', dict(self.docs))
+
+    def _fingerprint(self, pid):
+        directory = os.path.join(self.catalog.problem_dir, pid)
+        return (file_fingerprint(os.path.join(directory, 'information.yml')),
+                file_fingerprint(os.path.join(directory, 'info.html')))
+
+    def _weights(self, pid, info):
+        weights = {}
+        for token in search_tokens(str(info.get('name', ''))):
+            weights[token] = weights.get(token, 0) + SEARCH_TITLE_WEIGHT
+        try:
+            text = problem_text(os.path.join(self.catalog.problem_dir, pid, 'info.html'))
+        except OSError:
+            text = ''
+        for token in search_tokens(text):
+            weights[token] = weights.get(token, 0) + 1
+        return weights
+
+    def _add(self, pid, fingerprint, weights):
+        self.docs[pid] = (fingerprint, weights)
+        for token, weight in weights.items():
+            self.postings.setdefault(token, {})[pid] = weight
+
+    def _remove(self, pid):
+        fingerprint, weights = self.docs.pop(pid)
+        for token in weights:
+            postings = self.postings[token]
+            del postings[pid]
+            if not postings:
+                del self.postings[token]
+
+    def refresh(self):
+        # 只重新切分新增、删除或文件有变化的题目
+        pids = set(self.catalog.problems)
+        changed = []
+        for pid in pids:
+            fingerprint = self._fingerprint(pid)
+            doc = self.docs.get(pid)
+            if doc is None or doc[0] != fingerprint:
+                changed.append((pid, fingerprint, self._weights(pid, self.catalog.get(pid))))
+        removed = [pid for pid in self.docs if pid not in pids]
+        if not changed and not removed:
+            return
+        with self.lock:
+            for pid in removed:
+                self._remove(pid)
+            for pid, fingerprint, weights in changed:
+                if pid in self.docs:
+                    self._remove(pid)
+                self._add(pid, fingerprint, weights)
+
+    def search(self, query, filters):
+        # 返回 [(pid, 得分)]，按得分从高到低；query 为空时只按 filters 过滤
+        tokens = set(search_tokens(query, query=True))
+        if query and not tokens:
+            # 非空但全是标点或停用词的查询不匹配任何题目
+            return []
+        with self.lock:
+            if tokens:
+                postings = [self.postings.get(token, {}) for token in tokens]
+                postings.sort(key=len)
+                total = len(self.docs)
+                scores = {}
+                for pid in postings[0]:
+                    if all(pid in p for p in postings[1:]):
+                        scores[pid] = sum(p[pid] * math.log(1 + total / len(p)) for p in postings)
+            else:
+                scores = dict.fromkeys(self.docs, 0)
+        results = []
+        for pid, score in scores.items():
+            info = self.catalog.get(pid)
+            if info is None or any(str(info.get(field)) != value for field, value in filters.items()):
+                continue
+            results.append((pid, score))
+        results.sort(key=lambda x: (-x[1], int(x[0]) if x[0].isdigit() else 0, x[0]))
+        return results
+
+    def watch(self):
+        while True:
+            time.sleep(PROBLEM_WATCH_INTERVAL)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f'刷新题目搜索索引失败: {e}')
+
+problem_search = ProblemSearch(problem_catalog)
+snapshots.provide('problem_search', problem_search.snapshot)
+
+# 用户索引
+# 内存中按用户名索引 data/user.yml，并维护每个用户的 score/solved/try，
+# 评测出最终结果时增量更新，个人主页只需一次字典查找
+def problem_score(pid):
+    problem_info = problem_catalog.get(pid)
+    if problem_info and 'diff' in problem_info:
+        return int(problem_info['diff'])
+    return 0
+
+# 排行榜
+# 可按下标访问的跳表，按 (score 降序, solved 降序, try 升序, 用户名) 排序，
+# 查询名次 O(log n)，读取一页 O(log n + count)
+RANK_MAX_LEVEL = 20
+
+class _RankNode:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        self.width = [1] * level
+
+class RankList:
+    def __init__(self):
+        self.head = _RankNode(None, RANK_MAX_LEVEL)
+        self.size = 0
+        # username -> 当前在跳表中的 key
+        self.keys = {}
+
+    @staticmethod
+    def make_key(user):
+        return (-user.get('score', 0), -user.get('solved', 0), user.get('try', 0), user['username'])
+
+    def _find(self, key):
+        # 返回每一层中最后一个小于 key 的节点，以及这些节点的位置
+        chain = [None] * RANK_MAX_LEVEL
+        position = [0] * RANK_MAX_LEVEL
+        node, pos = self.head, 0
+        for level in reversed(range(RANK_MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key < key:
+                pos += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            position[level] = pos
+        return chain, position
+
+    def _insert(self, key):
+        chain, position = self._find(key)
+        level = 1
+        while level < RANK_MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        node = _RankNode(key, level)
+        for i in range(level):
+            prev = chain[i]
+            node.next[i] = prev.next[i]
+            prev.next[i] = node
+            node.width[i] = prev.width[i] - (position[0] - position[i])
+            prev.width[i] = position[0] - position[i] + 1
+        for i in range(level, RANK_MAX_LEVEL):
+            chain[i].width[i] += 1
+        self.size += 1
+
+    def _remove(self, key):
+        chain, _ = self._find(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            return
+        for i in range(len(node.next)):
+            chain[i].width[i] += node.width[i] - 1
+            chain[i].next[i] = node.next[i]
+        for i in range(len(node.next), RANK_MAX_LEVEL):
+            chain[i].width[i] -= 1
+        self.size -= 1
+
+    def update(self, user):
+        key = self.make_key(user)
+        old = self.keys.get(user['username'])
+        if old == key:
+            return
+        if old is not None:
+            self._remove(old)
+        self._insert(key)
+        self.keys[user['username']] = key
+
+    def discard(self, username):
+        old = self.keys.pop(username, None)
+        if old is not None:
+            self._remove(old)
+
+    def rank(self, username):
+        # 成绩相同的用户名次相同
+        key = self.keys.get(username)
+        if key is None:
+            return None
+        _, position = self._find(key[:3] + ('',))
+        return position[0] + 1
+
+    def page(self, start, count):
+        # 返回从第 start 名（0 起）开始的 count 个 (rank, key)
+        node, remaining = self.head, start + 1
+        for level in reversed(range(RANK_MAX_LEVEL)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        if remaining or node is self.head:
+            return []
+        rows = []
+        rank = self.rank(node.key[3])
+        position = start
+        while node is not None and len(rows) < count:
+            if rows and node.key[:3] != rows[-1][1][:3]:
+                rank = position + 1
+            rows.append((rank, node.key))
+            node = node.next[0]
+            position += 1
+        return rows
+
+USER_RELOAD_INTERVAL = 1
+
+# 密码哈希
+# user.yml 中保存 pbkdf2_sha256$迭代次数$盐$哈希；旧的明文密码在登录成功时升级，
+# 也可以用 python run.py hash-passwords 一次性升级。
+# 校验成功的结果放在有界 LRU 中（键为进程内随机密钥的 HMAC，不保存密码本身），
+# 反复登录不必每次都付出完整的哈希开销
+PASSWORD_ITERATIONS = 200000
+PASSWORD_PREFIX = 'pbkdf2_sha256'
+VERIFY_CACHE_SIZE = config.get('verify_cache_size', 1024)
+
+def hash_password(password, salt=None, iterations=PASSWORD_ITERATIONS):
+    salt = salt or os.urandom(16).hex()
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('ascii'), iterations).hex()
+    return f'{PASSWORD_PREFIX}${iterations}${salt}${digest}'
+
+def is_password_hashed(stored):
+    return str(stored).startswith(PASSWORD_PREFIX + '$')
+
+class PasswordVerifier:
+    def __init__(self, cache_size):
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.secret = os.urandom(32)
+
+    def verify(self, password, stored):
+        stored = str(stored)
+        if not is_password_hashed(stored):
+            # 尚未升级的明文密码
+            return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+        key = hmac.new(self.secret, f'{stored}\0{password}'.encode('utf-8'), hashlib.sha256).digest()
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return True
+        _, iterations, salt, _ = stored.split('$')
+        if not hmac.compare_digest(hash_password(password, salt, int(iterations)), stored):
+            return False
+        if self.cache_size > 0:
+            with self.lock:
+                self.cache[key] = True
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return True
+
+password_verifier = PasswordVerifier(VERIFY_CACHE_SIZE)
+
+class UserTable:
+    # user.yml 的内存模型：保持文件中的顺序，同时按用户名和 uid 索引，增删都是 O(1)
+    def __init__(self, users):
+        self.by_name = {}
+        self.by_uid = {}
+        self.max_uid = 0
+        for user in users:
+            self.add(user)
+
+    def add(self, user):
+        self.by_name[user['username']] = user
+        self.by_uid[int(user['uid'])] = user
+        self.max_uid = max(self.max_uid, int(user['uid']))
+
+    def remove(self, uid):
+        user = self.by_uid.pop(int(uid), None)
+        if user is not None:
+            del self.by_name[user['username']]
+        return user
+
+    def __len__(self):
+        return len(self.by_uid)
+
+    def __iter__(self):
+        return iter(self.by_uid.values())
+
+class UserIndex(YamlCollection):
+    def __init__(self):
+        super().__init__(os.path.join('data', 'user.yml'), os.path.join('tmp', 'user.lock'))
+
+    def read(self):
+        return load_users() or []
+
+    def build(self, users):
+        for user in users:
+            if 'score' not in user:
+                user['score'] = sum(problem_score(pid) for pid in user.get('solve_list', []))
+        return UserTable(users)
+
+    def dump(self, users):
+        return list(users)
+
+    def loaded(self):
+        self.users = self.data
+        self.by_name = self.data.by_name
+        self.ranklist = RankList()
+        for user in self.users:
+            self.ranklist.update(user)
+
+    def authenticate(self, username, password):
+        # 返回 (用户, 密码是否正确)，用户不存在时为 (None, False)
+        user = self.get(username)
+        if user is None:
+            return None, False
+        stored = user['password']
+        if not password_verifier.verify(password, stored):
+            return user, False
+        if not is_password_hashed(stored):
+            self.set_password(username, password)
+        return user, True
+
+    def set_password(self, username, password):
+        hashed = hash_password(password)
+
+        def op(users):
+            user = users.by_name.get(username)
+            if user is not None:
+                user['password'] = hashed
+            return user
+
+        with self.lock:
+            return self.apply(op)
+
+    def add(self, username, password, role='user'):
+        # 新用户的 uid 由 data/uid.seq 跨进程分配，已存在同名用户时返回 None
+        hashed = hash_password(password)
+        with self.lock:
+            self.reload_if_changed()
+            if username in self.by_name:
+                return None
+        # 写盘时重放 op 也使用同一个 uid，和返回给调用方的一致
+        uid = uid_allocator.next()
+
+        def op(users):
+            if username in users.by_name:
+                return None
+            user = {
+                'password': hashed,
+                'role': role,
+                'solve_list': [],
+                'solved': 0,
+                'try': 0,
+                'score': 0,
+                'uid': uid,
+                'username': username
+            }
+            users.add(user)
+            return user
+
+        with self.lock:
+            self.reload_if_changed()
+            user = self.apply(op)
+            if user is not None:
+                self.ranklist.update(user)
+            return user
+
+    def refresh(self):
+        # 评测结果可能由其他进程写入 user.yml
+        self.reload_if_changed(USER_RELOAD_INTERVAL)
+
+    def get(self, username):
+        self.refresh()
+        return self.by_name.get(username)
+
+    def _touch(self, users):
+        for user in users:
+            self.ranklist.update(user)
+
+    def record_results(self, results):
+        # results 为 (author, pid, status) 列表
+        def op(users):
+            touched = []
+            for author, pid, status in results:
+                user = users.by_name.get(author)
+                if user is None:
+                    continue
+                user['try'] = user.get('try', 0) + 1
+                if status == 0 and pid not in user.get('solve_list', []):
+                    user['solved'] = user.get('solved', 0) + 1
+                    user.setdefault('solve_list', []).append(pid)
+                    user['score'] = user.get('score', 0) + problem_score(pid)
+                touched.append(user)
+            return touched
+
+        with self.lock:
+            self._touch(self.apply(op))
+
+    def rebuild(self, submissions):
+        # 根据评测记录重新计算所有用户的 score/solved/try
+        stats = {}
+        for sub in submissions:
+            if not is_judged(sub['status']):
+                continue
+            stat = stats.setdefault(sub['author'], {'try': 0, 'solve_list': []})
+            stat['try'] += 1
+            if sub['status'] == 0 and sub['pid'] not in stat['solve_list']:
+                stat['solve_list'].append(sub['pid'])
+
+        def op(users):
+            for user in users:
+                stat = stats.get(user['username'], {'try': 0, 'solve_list': []})
+                user['try'] = stat['try']
+                user['solve_list'] = list(stat['solve_list'])
+                user['solved'] = len(stat['solve_list'])
+                user['score'] = sum(problem_score(pid) for pid in stat['solve_list'])
+            return list(users)
+
+        with self.lock:
+            self._touch(self.apply(op))
+            return len(self.users)
+
+    def delete_uid(self, uid):
+        def op(users):
+            return users.remove(uid)
+
+        with self.lock:
+            self.reload_if_changed()
+            user = self.apply(op)
+            if user is not None:
+                self.ranklist.discard(user['username'])
+            return user
+
+    def hash_all_passwords(self):
+        # 把仍为明文的密码全部升级为哈希
+        plain = [(user['username'], str(user['password'])) for user in self.users if not is_password_hashed(user['password'])]
+        for username, password in plain:
+            self.set_password(username, password)
+        return len(plain)
+
+def is_judged(status):
+    # 已由远程给出最终结果（不含未提交、提交失败、结果未知）
+    return status not in (5, 6, 7, 9, 10, -10, -5)
+
+user_index = UserIndex()
+
+# 远程镜像
+# config.yml 的 remote_mirrors 可以配置多个 HOJ 镜像（共用同一套账户和评测数据），未配置时只用 remote_oj。
+# 每次请求在可用镜像中选择 延迟（滑动平均）×（进行中的请求数 + 1）最小的一个，并以 MIRROR_EXPLORE 的概率
+# 随机探测其他镜像；连续失败 MIRROR_FAIL_THRESHOLD 次的镜像暂停使用，暂停时间按失败次数翻倍。
+# 连接没有建立起来的请求直接换下一个镜像重试
+MIRROR_EXPLORE = 0.05
+MIRROR_EWMA = 0.3
+MIRROR_FAIL_THRESHOLD = 3
+MIRROR_COOLDOWN = 5
+MIRROR_MAX_COOLDOWN = 120
+
+def request_not_sent(e):
+    # 连接都没有建立起来，远程一定没有收到请求
+    reason = getattr(e.args[0], 'reason', None) if e.args else None
+    return isinstance(e, requests.exceptions.ConnectTimeout) or isinstance(reason, NewConnectionError)
+
+class Mirror:
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        # 未测过延迟时为 None
+        self.latency = None
+        self.inflight = 0
+        self.failures = 0
+        self.down_until = 0
+
+class MirrorRouter:
+    def __init__(self, urls):
+        self.mirrors = [Mirror(url) for url in urls]
+        self.lock = threading.Lock()
+
+    def _pick(self, exclude):
+        now = time.time()
+        candidates = [m for m in self.mirrors if m not in exclude]
+        healthy = [m for m in candidates if m.down_until <= now]
+        if not healthy:
+            # 全部暂停时选最早恢复的一个
+            return min(candidates, key=lambda m: m.down_until)
+        # 还没有测过延迟的镜像先试一次，同一时间只让一个请求去探测，其余请求走已测过的镜像
+        untried = [m for m in healthy if m.latency is None]
+        probe = [m for m in untried if m.inflight == 0]
+        if probe:
+            return probe[0]
+        tried = [m for m in healthy if m.latency is not None]
+        if not tried:
+            return min(untried, key=lambda m: m.inflight)
+        if len(tried) > 1 and random.random() < MIRROR_EXPLORE:
+            return random.choice(tried)
+        return min(tried, key=lambda m: m.latency * (m.inflight + 1))
+
+    def _report(self, mirror, elapsed):
+        # elapsed 为 None 表示请求失败（连接错误、超时或 5xx），按超时计入延迟
+        if elapsed is None:
+            metrics.inc('hoj_mirror_errors_total', mirror=mirror.url)
+        with self.lock:
+            mirror.inflight -= 1
+            if elapsed is None:
+                mirror.failures += 1
+                if mirror.failures >= MIRROR_FAIL_THRESHOLD:
+                    cooldown = MIRROR_COOLDOWN * 2 ** (mirror.failures - MIRROR_FAIL_THRESHOLD)
+                    mirror.down_until = time.time() + min(cooldown, MIRROR_MAX_COOLDOWN)
+                elapsed = REMOTE_TIMEOUT
+            else:
+                mirror.failures = 0
+            if mirror.latency is None:
+                mirror.latency = elapsed
+            else:
+                mirror.latency += MIRROR_EWMA * (elapsed - mirror.latency)
+
+    def send(self, session, method, path, **kwargs):
+        tried = []
+        while True:
+            with self.lock:
+                mirror = self._pick(tried)
+                mirror.inflight += 1
+            tried.append(mirror)
+            metrics.inc('hoj_mirror_requests_total', mirror=mirror.url)
+            start = time.perf_counter()
+            try:
+                response = session.request(method, mirror.url + path, **kwargs)
+            except requests.RequestException as e:
+                self._report(mirror, None)
+                if isinstance(e, requests.ConnectionError) and request_not_sent(e) and len(tried) < len(self.mirrors):
+                    continue
+                raise
+            self._report(mirror, None if response.status_code >= 500 else time.perf_counter() - start)
+            return response
+
+remote_router = MirrorRouter(config.get('remote_mirrors') or [remote_oj])
+
+# 远程评测账户池
+# 每个 bot 账户持有自己的 keep-alive 会话、Authorization 令牌和已同步的 cfSession，
+# 轮换只在内存中进行，不再每次提交都改写 data/botuser.yml
+BOTUSER_FILE = os.path.join('data', 'botuser.yml')
+REMOTE_TIMEOUT = 10
+
+class RemoteError(Exception):
+    pass
+
+class BotSession:
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        self.session = requests.Session()
+        self.session.headers.update(common_headers)
+        self.token = None
+        self.cf_session = None
+        self.lock = threading.Lock()
+
+    def login(self):
+        # 模拟登录请求，请注意无论登录成功与否都会返回 200，需检查 status 字段
+        self.session.headers.pop('Authorization', None)
+        try:
+            response = self._send('POST', common_api['Login'], json={
+                "username": self.username,
+                "password": self.password
+            }, timeout=REMOTE_TIMEOUT)
+            response.raise_for_status()
+            result = response.json()
+        except Exception as e:
+            raise RemoteError(f'登录失败: {str(e)}，请联系管理员')
+        if result['status'] != 200:
+            raise RemoteError(f'登录失败: {result["msg"]}，请联系管理员')
+        # 从返回的 Header 中得到 token
+        token = response.headers.get("Authorization")
+        if not token:
+            raise RemoteError('登录失败，未返回token，可能是服务器问题')
+        self.token = token
+        self.session.headers['Authorization'] = token
+        # 重新登录后远程的 cfSession 绑定需要重新同步
+        self.cf_session = None
+
+    def ensure_login(self):
+        with self.lock:
+            if self.token is None:
+                self.login()
+
+    def _send(self, method, path, **kwargs):
+        # 所有远程调用都经过这里，按接口记录耗时和失败次数，按账户记录使用次数
+        op = _remote_ops.get(path, 'other')
+        metrics.inc('hoj_bot_requests_total', bot=self.username)
+        try:
+            with metrics.timer('hoj_remote_request_seconds', op=op):
+                return remote_router.send(self.session, method, path, **kwargs)
+        except Exception:
+            metrics.inc('hoj_remote_errors_total', op=op)
+            raise
+
+    def request(self, method, path, prepare=None, **kwargs):
+        # prepare 为重新登录后、重试之前需要重做的准备（如同步 cfSession）
+        kwargs.setdefault('timeout', REMOTE_TIMEOUT)
+        self.ensure_login()
+        token = self.token
+        response = self._send(method, path, **kwargs)
+        if _is_unauthorized(response):
+            # token 失效：重新登录后重试一次；其他线程已经换过 token 时直接用新的
+            with self.lock:
+                if self.token == token:
+                    self.login()
+            if prepare is not None:
+                prepare()
+            response = self._send(method, path, **kwargs)
+        # HOJ 会在响应头中下发刷新后的 token
+        refreshed = response.headers.get('Authorization')
+        if refreshed and refreshed != self.token:
+            self.token = refreshed
+            self.session.headers['Authorization'] = refreshed
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def ensure_cf_session(self, cf_session):
+        if self.cf_session == cf_session:
+            return
+        try:
+            response = self.post(common_api['updcfSession'], json={"cfSession": cf_session})
+            response.raise_for_status()
+            result = response.json()
+        except Exception as e:
+            raise RemoteError(f'未知错误{str(e)}')
+        if result.get("status") != 200:
+            raise RemoteError('CFSession更新失败')
+        self.cf_session = cf_session
+
+# 远程接口路径 -> data/api.yml 中的名称，作为指标标签
+_remote_ops = {path: name for name, path in common_api.items()}
+
+def _is_unauthorized(response):
+    if response.status_code == 401:
+        return True
+    try:
+        return response.json().get('status') == 401
+    except Exception:
+        return False
+
+class BotSessionPool:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.sessions = []
+        self.next = 0
+        self.mtime = None
+
+    def _reload_if_changed(self):
+        # 管理员修改 botuser.yml 后自动生效，已登录的会话尽量保留
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            self.sessions, self.mtime = [], None
+            return
+        if mtime == self.mtime:
+            return
+        def parse():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return yaml.safe_load(f) or []
+        botuser = snapshots.load_yaml(self.path, parse)
+        old = {(s.username, s.password): s for s in self.sessions}
+        self.sessions = [old.get((b['username'], b['password'])) or BotSession(b['username'], b['password'])
+                         for b in botuser]
+        self.next = 0
+        self.mtime = mtime
+
+    def acquire(self, ready=None):
+        # 轮询选择下一个账户，防止重复调用同一账户；ready 用于跳过暂时不可用的账户，全都不可用时返回 None
+        with self.lock:
+            self._reload_if_changed()
+            if not self.sessions:
+                raise LookupError('未配置远程账户，请联系管理员')
+            for _ in range(len(self.sessions)):
+                bot = self.sessions[self.next % len(self.sessions)]
+                self.next = (self.next + 1) % len(self.sessions)
+                if ready is None or ready(bot):
+                    return bot
+            return None
+
+    def count(self):
+        with self.lock:
+            self._reload_if_changed()
+            return len(self.sessions)
+
+    def find(self, username):
+        with self.lock:
+            self._reload_if_changed()
+            return next((s for s in self.sessions if s.username == username), None)
+
+bot_pool = BotSessionPool(BOTUSER_FILE)
+
+# runid 分配器
+# data/runid.seq 中保存已预留到的最大 runid（下一个可预留的值），每次在跨进程锁内预留
+# RUNID_BLOCK 个，进程内从预留块中无锁发号；重启或多进程时未用完的号会被跳过
+RUNID_SEQ = os.path.join('data', 'runid.seq')
+
+class RunidAllocator:
+    def __init__(self, path, block, lock_path=os.path.join('tmp', 'runid.lock')):
+        self.path = path
+        self.block_size = block
+        self.lock = threading.Lock()
+        self.file_lock = FileLock(lock_path)
+        # (计数器, 上界)，整体替换保证读取时一致
+        self.block = (itertools.count(0), 0)
+
+    def _initial(self):
+        # 首次运行时从 config.yml 的 last_runid 和已有评测记录继续编号
+        config = load_config()
+        last = max([config.get('last_runid', 0)] + submission_store.runids[-1:])
+        return last + 1
+
+    def _reserve(self):
+        with self.file_lock:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    start = int(f.read().strip())
+            except (OSError, ValueError):
+                start = self._initial()
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(f'{start + self.block_size}\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        return (itertools.count(start), start + self.block_size)
+
+    def next(self):
+        while True:
+            block = self.block
+            # itertools.count 的 next 在 GIL 下是原子的
+            runid = next(block[0])
+            if runid < block[1]:
+                return runid
+            with self.lock:
+                if self.block is block:
+                    self.block = self._reserve()
+
+runid_allocator = RunidAllocator(RUNID_SEQ, config.get('runid_block', 16))
+
+# uid 分配器
+# data/uid.seq 中保存下一个可用的 uid，每次只预留一个，删除用户后 uid 也不会被重新使用
+UID_SEQ = os.path.join('data', 'uid.seq')
+
+class UidAllocator(RunidAllocator):
+    def __init__(self, path):
+        super().__init__(path, 1, os.path.join('tmp', 'uid.lock'))
+
+    def _initial(self):
+        # 首次运行时从 config.yml 的 last_uid 和已有用户继续编号
+        return max(load_config().get('last_uid', 0), user_index.users.max_uid) + 1
+
+uid_allocator = UidAllocator(UID_SEQ)
+
+def next_runid():
+    # 分配本地 runid
+    return runid_allocator.next()
+
+def fetch_result(adapter, job):
+    # 单条获取远程评测结果
+    response = job.bot.get(common_api[adapter.poll_api], params={'submitId': job.submit_id})
+    submission = response.json()['data']['submission']
+    return {job.submit_id: submission}
+
+class BatchUnsupported(Exception):
+    # 远程没有批量查询接口
+    pass
+
+def fetch_results(adapter, bot, jobs):
+    # 一次请求批量获取同一账户下多条提交的评测状态
+    response = bot.post(common_api[adapter.batch_poll_api], json={'submitIds': [job.submit_id for job in jobs]})
+    # 接口不存在时返回的 404 页面不一定是 JSON，先看状态码
+    if response.status_code == 404:
+        raise BatchUnsupported(common_api[adapter.batch_poll_api])
+    result = response.json()
+    if result.get('status') == 404:
+        raise BatchUnsupported(common_api[adapter.batch_poll_api])
+    return {int(k): v for k, v in result['data'].items()}
+
+def craw_submit(jobs):
+    # 拉取一批待评测提交的远程结果，返回已得到最终状态的 job
+    # 远程支持批量接口时按 (适配器, 账户) 分组各发一次请求，否则并发逐条获取
+    groups = {}
+    for job in jobs:
+        groups.setdefault((remote_registry.get(job.remote), job.bot), []).append(job)
+    futures = []
+    for (adapter, bot), group in groups.items():
+        if adapter.batch_supported:
+            futures.append((adapter, poll_fetcher.submit(fetch_results, adapter, bot, group)))
+        else:
+            futures.extend((adapter, poll_fetcher.submit(fetch_result, adapter, job)) for job in group)
+    results = {}
+    for adapter, future in futures:
+        try:
+            results.update(future.result())
+        except BatchUnsupported:
+            print(f'{adapter.name} 不支持批量查询评测状态，改为逐条获取')
+            adapter.batch_supported = False
+        except Exception as e:
+            print(f'获取评测结果失败: {str(e)}')
+
+    updates = {}
+    finished = []
+    for job in jobs:
+        submission = results.get(job.submit_id)
+        if submission is None:
+            continue
+        updates[job.runid] = {
+            'status': submission['status'],
+            'timems': submission['time'],
+            'memorykb': submission['memory'],
+            'score': submission['score']
+        }
+        if submission['status'] not in (5,6,7):
+            finished.append(job)
+    # 整批结果只写一次
+    if updates:
+        submission_store.update_many(updates)
+        status_hub.publish(updates)
+    if finished:
+        user_index.record_results([(job.author, job.pid, updates[job.runid]['status']) for job in finished])
+        contest_board.record([job.runid for job in finished])
+        pending_journal.done([job.runid for job in finished])
+        # 等待相同代码结果的提交直接复用
+        for job in finished:
+            followers = verdict_cache.settle(job.runid, updates[job.runid])
+            if followers:
+                apply_verdict(followers, updates[job.runid])
+    return finished
+
+def expire_submission(job):
+    # 超过最长轮询时间仍未出结果，记为 Submitted Unknown Result
+    submission_store.update(job.runid, {'status': -5})
+    status_hub.publish({job.runid: {'status': -5}})
+    pending_journal.done([job.runid])
+    verdict_cache.settle(job.runid, None)
+
+# 评测状态推送
+# 轮询器把每批状态变化发布到这里，SSE 连接在各自提交的 Condition 上等待，空闲连接不产生任何读取开销。
+# 每个连接在 gthread worker 中占用一个线程：连接最多保持 SSE_STREAM_LIFETIME 秒后由服务端关闭，
+# EventSource 按 retry 提示带着 Last-Event-ID 重连；每个 worker 同时最多 sse_slots 个连接，
+# 超过时返回 503，页面改为轮询，保证普通请求总有空闲线程
+STATUS_EVENT_TTL = 60
+SSE_KEEPALIVE = 15
+SSE_STREAM_LIFETIME = 25
+SSE_RETRY_MS = 3000
+sse_slots = None
+
+def limit_sse_streams(threads):
+    # 生产模式下每个 worker 留出一半线程处理普通请求
+    global sse_slots
+    sse_slots = threading.BoundedSemaphore(max(1, threads // 2))
+
+class StatusHub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0
+        # runid -> (version, 状态字段, 结束时间)
+        self.events = {}
+        # runid -> 正在等待的连接数
+        self.watching = {}
+        # runid -> 该提交的连接等待的条件变量，发布时只唤醒对应提交的连接
+        self.conditions = {}
+
+    def publish(self, updates):
+        now = time.time()
+        with self.lock:
+            # 只发布真正发生变化的状态
+            changed = {runid: dict(fields, runid=runid) for runid, fields in updates.items()
+                       if runid not in self.events or self.events[runid][1] != dict(fields, runid=runid)}
+            if not changed:
+                return
+            self.version += 1
+            for runid, fields in changed.items():
+                finished = now if fields['status'] not in (5,6,7,9) else None
+                self.events[runid] = (self.version, fields, finished)
+            # 已结束的提交保留一段时间，供正在连接的客户端读取
+            self.events = {k: v for k, v in self.events.items() if v[2] is None or now - v[2] < STATUS_EVENT_TTL}
+            for runid in changed:
+                cond = self.conditions.get(runid)
+                if cond is not None:
+                    cond.notify_all()
+
+    def current(self, runid):
+        # 返回 (version, 状态字段)；没有缓存的事件时状态字段为 None，version 为当前版本，
+        # 之后发布的事件版本都比它大
+        with self.lock:
+            event = self.events.get(runid)
+            if event is not None:
+                return event[:2]
+            return self.version, None
+
+    def watch(self, runid, delta):
+        with self.lock:
+            count = self.watching.get(runid, 0) + delta
+            if count > 0:
+                self.watching[runid] = count
+                self.conditions.setdefault(runid, threading.Condition(self.lock))
+            else:
+                self.watching.pop(runid, None)
+                self.conditions.pop(runid, None)
+
+    def wait(self, runid, version, timeout):
+        # 等待 runid 出现比 version 更新的状态，超时返回 None；调用前需先 watch(runid, 1)
+        def changed():
+            event = self.events.get(runid)
+            return event is not None and event[0] > version
+        with self.lock:
+            cond = self.conditions.get(runid)
+            if cond is not None and cond.wait_for(changed, timeout):
+                return self.events[runid][:2]
+        return None
+
+status_hub = StatusHub()
+
+# 评测结果轮询
+# 所有待评测的提交由一个调度线程统一管理：按下次轮询时间排序的小根堆，
+# 每次取出所有到期的提交（最多 POLL_BATCH_SIZE 条）一起查询，
+# 轮询间隔从 POLL_FIRST_INTERVAL 开始按 POLL_BACKOFF 递增到 POLL_MAX_INTERVAL，
+# 同时最多 POLL_WORKERS 个请求在访问远程 OJ，超过 POLL_LIFETIME 秒放弃轮询
+POLL_WORKERS = 4
+POLL_BATCH_SIZE = 50
+POLL_FIRST_INTERVAL = 0.5
+POLL_MAX_INTERVAL = 10
+POLL_BACKOFF = 1.5
+POLL_LIFETIME = 30 * 60
+
+poll_fetcher = ThreadPoolExecutor(max_workers=POLL_WORKERS, thread_name_prefix='poll')
+
+class PollJob:
+    def __init__(self, submit_id, runid, pid, bot, author, remote=None):
+        self.submit_id = submit_id
+        self.runid = runid
+        self.pid = pid
+        self.bot = bot
+        self.author = author
+        self.remote = remote
+        self.created = time.time()
+        self.interval = POLL_FIRST_INTERVAL
+
+class PollScheduler:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.heap = []
+        self.seq = itertools.count()
+        self.running = 0
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def add(self, job, delay=POLL_FIRST_INTERVAL):
+        with self.cond:
+            heapq.heappush(self.heap, (time.time() + delay, next(self.seq), job))
+            self.cond.notify()
+
+    def pending(self):
+        with self.cond:
+            return len(self.heap) + self.running
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.heap or self.heap[0][0] > time.time():
+                    self.cond.wait(self.heap[0][0] - time.time() if self.heap else None)
+                now = time.time()
+                jobs = []
+                while self.heap and self.heap[0][0] <= now and len(jobs) < POLL_BATCH_SIZE:
+                    jobs.append(heapq.heappop(self.heap)[2])
+                self.running = len(jobs)
+            try:
+                finished = set(craw_submit(jobs))
+            except Exception as e:
+                print(f'获取评测结果失败: {str(e)}')
+                finished = set()
+            with self.cond:
+                self.running = 0
+            for job in jobs:
+                if job in finished:
+                    continue
+                if time.time() - job.created > POLL_LIFETIME:
+                    expire_submission(job)
+                    continue
+                job.interval = min(job.interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+                self.add(job, job.interval)
+
+poll_scheduler = PollScheduler()
+
+# 多进程部署
+# 只有抢到 tmp/poller.lock 的进程负责轮询，轮询进程退出后锁自动释放，由其他进程接替
+#
+# 待评测日志
+# 提交到远程成功后，远程 submitId、远程 OJ、bot 账户等先追加写入 data/pending_judge.jsonl，
+# 出结果或过期后再追加 done。轮询进程启动时从日志中一次性恢复所有未完成的轮询，
+# 之后持续读取其他进程追加的条目；重启或部署不会丢失评测结果
+PENDING_JOURNAL = os.path.join('data', 'pending_judge.jsonl')
+PENDING_TAIL_INTERVAL = 0.2
+# 日志超过该大小且大部分条目已完成时重写，只保留未完成的条目
+PENDING_COMPACT_SIZE = 1 << 20
+POLLER_ELECT_INTERVAL = 5
+STATUS_RELAY_INTERVAL = 1
+
+poller_lock = FileLock(os.path.join('tmp', 'poller.lock'))
+is_poller = False
+
+class PendingJournal:
+    def __init__(self, path):
+        self.path = path
+        self.file_lock = FileLock(os.path.join('tmp', 'pending_judge.lock'))
+        self.lock = threading.Lock()
+        # 已读到的文件位置
+        self.offset = 0
+        # runid -> 未完成的条目
+        self.live = {}
+
+    def _append(self, entries):
+        with self.file_lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def add(self, job):
+        entry = {
+            'op': 'add',
+            'runid': job.runid,
+            'submit_id': job.submit_id,
+            'remote': job.remote,
+            'bot': job.bot.username,
+            'pid': job.pid,
+            'author': job.author,
+            'created': job.created
+        }
+        self._append([entry])
+        with self.lock:
+            self.live[job.runid] = entry
+
+    def done(self, runids):
+        if not runids:
+            return
+        self._append([{'op': 'done', 'runid': runid} for runid in runids])
+        with self.lock:
+            for runid in runids:
+                self.live.pop(runid, None)
+
+    def tail(self):
+        # 读入新追加的条目，返回其中还未完成、本进程也还不知道的条目
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return []
+        if size <= self.offset:
+            return []
+        added = {}
+        with self.lock, open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                self.offset += len(line)
+                entry = json.loads(line)
+                if entry['op'] == 'add':
+                    if entry['runid'] not in self.live:
+                        self.live[entry['runid']] = entry
+                        added[entry['runid']] = entry
+                else:
+                    self.live.pop(entry['runid'], None)
+                    added.pop(entry['runid'], None)
+        return list(added.values())
+
+    def compact(self):
+        # 只由轮询进程调用：全部完成时清空，文件过大时只保留未完成的条目
+        if self.offset == 0 or (self.live and self.offset < PENDING_COMPACT_SIZE):
+            return
+        with self.file_lock, self.lock:
+            if os.path.getsize(self.path) != self.offset:
+                return
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in self.live.values()))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.offset = os.path.getsize(self.path)
+
+pending_journal = PendingJournal(PENDING_JOURNAL)
+
+def dispatch_poll(job):
+    # 先写日志再开始轮询；非轮询进程写入的条目由轮询进程读取日志时接手
+    pending_journal.add(job)
+    if is_poller:
+        poll_scheduler.add(job)
+
+def resume_job(entry):
+    # 提交只能用提交它的账户查询，账户已被删除时无法再取得结果，返回 None
+    bot = bot_pool.find(entry['bot'])
+    if bot is None:
+        print(f'runid {entry["runid"]} 的提交账户 {entry["bot"]} 已不存在，无法恢复轮询')
+        set_submission_status(entry['runid'], -5)
+        pending_journal.done([entry['runid']])
+        return None
+    job = PollJob(entry['submit_id'], entry['runid'], entry['pid'], bot, entry['author'], entry.get('remote'))
+    job.created = entry['created']
+    return job
+
+def expire_orphans():
+    # 日志之外仍处于 Pending/Compiling/Judging 的提交（如启用日志之前遗留的）已无法恢复，记为 Submitted Unknown Result
+    orphans = []
+    for status in (5, 6, 7):
+        for sub in submission_store.query({'status': str(status)}, count=len(submission_store)):
+            if sub['runid'] not in pending_journal.live:
+                orphans.append(sub['runid'])
+    if orphans:
+        print(f'{len(orphans)} 个提交没有待评测记录，无法恢复轮询')
+        submission_store.update_many({runid: {'status': -5} for runid in orphans})
+        status_hub.publish({runid: {'status': -5, 'timems': None, 'memorykb': None, 'score': None} for runid in orphans})
+
+def follow_pending_journal():
+    while True:
+        try:
+            for entry in pending_journal.tail():
+                job = resume_job(entry)
+                if job is not None:
+                    poll_scheduler.add(job)
+            pending_journal.compact()
+        except Exception as e:
+            print(f'读取待评测日志失败: {str(e)}')
+        time.sleep(PENDING_TAIL_INTERVAL)
+
+def elect_poller():
+    global is_poller
+    while not poller_lock.acquire(blocking=False):
+        time.sleep(POLLER_ELECT_INTERVAL)
+    is_poller = True
+    # 一次性恢复上一个轮询进程留下的全部未完成轮询，按批量接口分批查询
+    resumed = [job for job in map(resume_job, pending_journal.tail()) if job is not None]
+    for job in resumed:
+        poll_scheduler.add(job, 0)
+    if resumed:
+        print(f'已恢复 {len(resumed)} 个未完成的评测轮询')
+    expire_orphans()
+    poll_scheduler.start()
+    submit_dispatcher.start()
+    threading.Thread(target=contest_board.run, daemon=True).start()
+    follow_pending_journal()
+
+def relay_status():
+    # 非轮询进程从存储中读取被订阅提交的最新状态，转发给本进程的 SSE 连接
+    while True:
+        time.sleep(STATUS_RELAY_INTERVAL)
+        if is_poller or not status_hub.watching:
+            continue
+        updates = {}
+        for runid in list(status_hub.watching):
+            submission = submission_store.get(runid)
+            if submission:
+                updates[runid] = {k: submission[k] for k in ('status', 'timems', 'memorykb', 'score')}
+        status_hub.publish(updates)
+
+# 提交队列
+# /api/submit-remote 只把提交写入 data/submit_queue.jsonl 并立即返回 runid（状态 9 Submitting），
+# 由轮询进程中的调度线程按令牌桶限速（每个远程 OJ 一个桶、每个 bot 账户一个桶）提交到远程，
+# 可重试的失败按指数退避重试，最终失败记为 10 Submitted Failed；
+# 请求可能已被远程接收但没有拿到结果时记为 -5 Submitted Unknown Result，不再重复提交
+SUBMIT_QUEUE = os.path.join('data', 'submit_queue.jsonl')
+SUBMIT_QUEUE_INTERVAL = 0.1
+SUBMIT_MAX_ATTEMPTS = 3
+SUBMIT_RETRY_DELAY = 2
+# 每个远程 OJ：每秒 2 次，最多积攒 5 次
+SUBMIT_REMOTE_RATE = (2, 5)
+# 每个 bot 账户：HOJ 默认同一用户两次提交至少间隔 8 秒
+SUBMIT_BOT_RATE = (1 / 8, 1)
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.time()
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        # 距离下一个令牌可用还需等待的秒数
+        self._refill()
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+# 远程适配器
+# 每种 isremote 对应一个适配器，声明语言表、提交和查询用的接口（data/api.yml 中的名称）、限速和并发上限。
+# 每个适配器有独立的提交线程池，某个远程变慢时只会占满它自己的并发名额。
+# config.yml 的 remote_adapters 可以覆盖限速和并发，如 {cf: {rate: [1, 3], concurrency: 1}}
+REMOTE_CONCURRENCY = 2
+remote_adapter_types = {}
+
+def register_remote(cls):
+    remote_adapter_types[cls.name] = cls
+    return cls
+
+class RemoteAdapter:
+    # 未注册的 isremote 按此处理：语言原样提交，由 HOJ 转交远程评测
+    name = None
+    is_remote = True
+    # 本站语言 -> 远程语言，None 表示原样提交
+    languages = None
+    unsupported = '此题目不支持该语言'
+    submit_api = 'submitProblem'
+    poll_api = 'GetSubmission'
+    batch_poll_api = 'CheckSubmissionsStatus'
+    rate = SUBMIT_REMOTE_RATE
+    concurrency = REMOTE_CONCURRENCY
+
+    def __init__(self, name, options):
+        self.name = name
+        self.bucket = TokenBucket(*options.get('rate', self.rate))
+        self.concurrency = options.get('concurrency', self.concurrency)
+        self.slots = threading.BoundedSemaphore(self.concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f'submit-{name}')
+        # 远程不支持批量查询时退回逐条获取
+        self.batch_supported = self.batch_poll_api in common_api
+
+    def language(self, lang):
+        # 返回远程使用的语言名，不支持时返回 None
+        if self.languages is None:
+            return lang
+        return self.languages.get(lang)
+
+    def prepare(self, bot):
+        # 提交前的准备，失败时提交还没有发出
+        bot.ensure_login()
+
+    def payload(self, item):
+        return {
+            'pid': item['remote_pid'],
+            'gid': None,
+            'isRemote': self.is_remote,
+            'code': item['code'],
+            'language': item['lang'],
+            'tid': None
+        }
+
+@register_remote
+class LocalAdapter(RemoteAdapter):
+    # HOJ 本地题目
+    name = 'mine'
+    is_remote = False
+
+@register_remote
+class HduAdapter(RemoteAdapter):
+    name = 'hdu'
+    languages = {'C++': 'G++', 'C++ With O2': 'G++', 'C': 'GCC', 'C With O2': 'GCC'}
+    unsupported = '此题目仅支持C++和C语言'
+
+@register_remote
+class PojAdapter(HduAdapter):
+    name = 'poj'
+
+@register_remote
+class CodeforcesAdapter(RemoteAdapter):
+    name = 'cf'
+    languages = {
+        'C++': 'GNU G++17',
+        'C++ 17': 'GNU G++17',
+        'C++ 20': 'GNU G++20',
+        'Python 3': 'Python 3.9.1',
+        'Java': 'Java 1.8.0_241 '
+    }
+    unsupported = '此题目仅支持 C++, C++ 17, C++ 20, Java, Python 语言'
+
+    def prepare(self, bot):
+        super().prepare(bot)
+        bot.ensure_cf_session(cf_jsession)
+
+def check_adapter_options(name, options):
+    # 校验 remote_adapters 中的限速和并发，不合法的项打印提示并使用默认值
+    options = dict(options or {})
+    concurrency = options.get('concurrency')
+    if concurrency is not None and (type(concurrency) is not int or concurrency < 1):
+        print(f'remote_adapters.{name}.concurrency 应为不小于 1 的整数，已使用默认值')
+        del options['concurrency']
+    rate = options.get('rate')
+    if rate is not None and not (isinstance(rate, (list, tuple)) and len(rate) == 2
+                                 and all(type(v) in (int, float) and v > 0 for v in rate)):
+        print(f'remote_adapters.{name}.rate 应为两个正数 [每秒次数, 突发上限]，已使用默认值')
+        del options['rate']
+    return options
+
+class RemoteRegistry:
+    def __init__(self, options):
+        self.options = {name: check_adapter_options(name, value) for name, value in options.items()}
+        self.lock = threading.Lock()
+        self.adapters = {}
+
+    def get(self, name):
+        # 按 isremote 取适配器，首次使用时创建
+        name = name or 'mine'
+        with self.lock:
+            adapter = self.adapters.get(name)
+            if adapter is None:
+                cls = remote_adapter_types.get(name, RemoteAdapter)
+                adapter = self.adapters[name] = cls(name, self.options.get(name, {}))
+            return adapter
+
+remote_registry = RemoteRegistry(config.get('remote_adapters') or {})
+
+class SubmitRetry(Exception):
+    # 请求没有到达远程，可以安全重试；retry_after 为远程要求的最短等待秒数
+    def __init__(self, message, retry_after=0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class SubmitQueue:
+    def __init__(self, path):
+        self.path = path
+        self.file_lock = FileLock(os.path.join('tmp', 'submit_queue.lock'))
+        # 已读到的文件位置
+        self.offset = 0
+        # runid -> 待提交的条目，按入队顺序
+        self.pending = {}
+        # 上次退出时正在发送、结果未知的 runid
+        self.unknown = []
+        # 回放时标记为发送中的条目，之后确认未发出时放回 pending
+        self.sent = {}
+        self.replayed = False
 
-def load_users():
-    user_file = os.path.join('data', 'user.yml')
-    if os.path.exists(user_file):
-        try:
-            with open(user_file, 'r', encoding='utf-8') as f:
-                return yaml.safe_load(f) or {}
-        except Exception as e:
-            print(f'读取用户文件失败: {e}')
-    return {}
-def save_users(users):
-    user_file = os.path.join('data', 'user.yml')
-    if os.path.exists(user_file):
+    def _append(self, entry):
+        with self.file_lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                # 接口返回 runid 之前条目必须已经落盘
+                f.flush()
+                os.fsync(f.fileno())
+
+    def put(self, item):
+        self._append(dict(item, op='add'))
+
+    def sending(self, runid):
+        self._append({'op': 'sending', 'runid': runid})
+
+    def unsent(self, runid):
+        # 请求确认没有到达远程，条目会重新提交
+        self._append({'op': 'unsent', 'runid': runid})
+
+    def done(self, runid):
+        self.pending.pop(runid, None)
+        self._append({'op': 'done', 'runid': runid})
+
+    def tail(self):
+        # 读入新入队的条目；全部处理完后清空文件
         try:
-            with open(user_file, 'w', encoding='utf-8') as f:
-                yaml.dump(users, f, allow_unicode=True)
-        except Exception as e:
-            print(f'保存用户文件失败: {e}')
-            return False
-    return True
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size > self.offset:
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    self.offset += len(line)
+                    entry = json.loads(line)
+                    if entry['op'] == 'add':
+                        entry['attempts'] = 0
+                        entry['next_try'] = 0
+                        self.pending[entry['runid']] = entry
+                    elif entry['op'] == 'sending' and not self.replayed:
+                        item = self.pending.pop(entry['runid'], None)
+                        if item is not None:
+                            self.sent[entry['runid']] = item
+                        self.unknown.append(entry['runid'])
+                    elif entry['op'] == 'unsent' and not self.replayed:
+                        item = self.sent.pop(entry['runid'], None)
+                        if entry['runid'] in self.unknown:
+                            self.unknown.remove(entry['runid'])
+                            if item is not None:
+                                self.pending[entry['runid']] = item
+                    elif entry['op'] == 'done':
+                        self.pending.pop(entry['runid'], None)
+                        self.sent.pop(entry['runid'], None)
+                        if entry['runid'] in self.unknown:
+                            self.unknown.remove(entry['runid'])
+        elif not self.pending and not self.unknown and size:
+            with self.file_lock:
+                if os.path.getsize(self.path) == self.offset:
+                    open(self.path, 'w').close()
+                    self.offset = 0
+        self.replayed = True
 
+# 重复提交判定缓存
+# 同一题目、同一语言、规范化后相同的代码在 TTL 内直接复用最近一次的最终结果；
+# 相同代码已在提交或评测中时，新提交挂在它后面等结果，不再占用远程提交和轮询
+VERDICT_CACHE_STATS = os.path.join('tmp', 'verdict_cache.json')
+VERDICT_CACHE_FLUSH_INTERVAL = 1
+# 只缓存确定的评测结果，System Error、提交失败、结果未知等不缓存
+CACHEABLE_STATUS = (0, 1, 2, 3, 8, -3, -2, -1)
 
-# 生成token
-def generate_token(username):
-    token = str(uuid.uuid4())
-    # 设置token过期时间为7天
-    expire_date = datetime.datetime.now() + datetime.timedelta(days=7)
-    return token, expire_date
+def code_key(pid, lang, code):
+    # 只统一换行符和文件末尾的换行，其余空白可能影响评测（如 Whitespace 语言）
+    normalized = code.replace('\r\n', '\n').rstrip('\n')
+    return hashlib.sha256(f'{pid}\0{lang}\0{normalized}'.encode('utf-8')).hexdigest()
 
-# 加载token
-def load_tokens():
-    token_file = os.path.join('tmp', 'token.yml')
+class VerdictCache:
+    def __init__(self, ttl, stats_path):
+        self.ttl = ttl
+        self.stats_path = stats_path
+        self.lock = threading.Lock()
+        # key -> (过期时间, 评测结果)
+        self.verdicts = {}
+        # key -> 正在提交或评测的 runid，以及 runid -> key
+        self.leaders = {}
+        self.leader_keys = {}
+        # 领头 runid -> 等待它结果的队列条目
+        self.followers = {}
+        self.stats = {'hits': 0, 'coalesced': 0, 'misses': 0, 'bypassed': 0}
+        self.dirty = False
+        self.flushed = 0
 
-    if os.path.exists(token_file):
+    def lookup(self, item, bypass=False):
+        # 返回 ('hit', 评测结果)、('follow', 领头 runid) 或 None（需要提交到远程）
+        # ttl <= 0 只关闭结果缓存，相同代码的在途提交仍然合并
+        key = code_key(item['pid'], item['lang'], item['code'])
+        with self.lock:
+            self.dirty = True
+            if bypass:
+                self.stats['bypassed'] += 1
+            else:
+                cached = self.verdicts.get(key) if self.ttl > 0 else None
+                if cached is not None and cached[0] > time.time():
+                    self.stats['hits'] += 1
+                    return 'hit', cached[1]
+                leader = self.leaders.get(key)
+                if leader is not None:
+                    self.stats['coalesced'] += 1
+                    self.followers.setdefault(leader, []).append(item)
+                    return 'follow', leader
+                self.stats['misses'] += 1
+            if key not in self.leaders:
+                self.leaders[key] = item['runid']
+                self.leader_keys[item['runid']] = key
+            return None
+
+    def settle(self, runid, result):
+        # 领头提交结束：缓存结果并返回等待它的条目；结果不可缓存时返回空列表，
+        # 等待的条目重新放回队列正常提交
+        with self.lock:
+            key = self.leader_keys.pop(runid, None)
+            if key is None:
+                return []
+            del self.leaders[key]
+            followers = self.followers.pop(runid, [])
+            if result is None or result['status'] not in CACHEABLE_STATUS:
+                for item in followers:
+                    item.pop('waiting', None)
+                    item.pop('checked', None)
+                return []
+            if self.ttl > 0:
+                self.verdicts[key] = (time.time() + self.ttl, result)
+            return followers
+
+    def prune(self):
+        now = time.time()
+        with self.lock:
+            for key in [key for key, (expire, _) in self.verdicts.items() if expire <= now]:
+                del self.verdicts[key]
+
+    def summary(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.verdicts)
+        stats['ttl'] = self.ttl
+        # 命中和合并的提交都省掉了一次远程提交
+        stats['saved_remote_calls'] = stats['hits'] + stats['coalesced']
+        looked_up = stats['hits'] + stats['coalesced'] + stats['misses']
+        stats['hit_rate'] = round(stats['saved_remote_calls'] / looked_up, 4) if looked_up else 0
+        return stats
+
+    def flush_stats(self):
+        # 计数只在轮询进程里，写到文件里供各 worker 的管理接口读取
+        if not self.dirty or time.time() - self.flushed < VERDICT_CACHE_FLUSH_INTERVAL:
+            return
+        self.dirty = False
+        self.flushed = time.time()
+        self.prune()
+        tmp_path = self.stats_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f)
+        os.replace(tmp_path, self.stats_path)
+
+def apply_verdict(items, result):
+    # 把复用的评测结果写给一批队列条目，写入后再从队列中移除
+    submission_store.update_many({item['runid']: result for item in items})
+    status_hub.publish({item['runid']: result for item in items})
+    user_index.record_results([(item['author'], item['pid'], result['status']) for item in items])
+    contest_board.record([item['runid'] for item in items])
+    for item in items:
+        submit_queue.done(item['runid'])
+
+class SubmitDispatcher:
+    def __init__(self, queue):
+        self.queue = queue
+        self.bot_buckets = {}
+        self.inflight = set()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def depth(self):
+        return len(self.queue.pending)
+
+    def _bot_bucket(self, bot):
+        return self.bot_buckets.setdefault(bot.username, TokenBucket(*SUBMIT_BOT_RATE))
+
+    def run(self):
+        while True:
+            try:
+                self.queue.tail()
+                # 发送中途退出的提交无法确认是否已被远程接收
+                while self.queue.unknown:
+                    runid = self.queue.unknown.pop()
+                    # 已写入待评测日志的提交会继续轮询
+                    if runid not in pending_journal.live:
+                        set_submission_status(runid, -5)
+                    self.queue.done(runid)
+                wait = self._dispatch()
+                verdict_cache.flush_stats()
+            except Exception as e:
+                print(f'提交队列处理失败: {str(e)}')
+                wait = SUBMIT_QUEUE_INTERVAL
+            time.sleep(min(wait, SUBMIT_QUEUE_INTERVAL))
+
+    def _dispatch(self):
+        # 按入队顺序派发所有限速允许的条目，返回需要等待的时间
+        wait = SUBMIT_QUEUE_INTERVAL
+        now = time.time()
+        for runid, item in list(self.queue.pending.items()):
+            if runid in self.inflight or item.get('waiting'):
+                continue
+            if not item.get('checked'):
+                item['checked'] = True
+                cached = verdict_cache.lookup(item, bypass=item.get('bypass_cache', False))
+                if cached is not None and cached[0] == 'hit':
+                    apply_verdict([item], cached[1])
+                    continue
+                if cached is not None:
+                    item['waiting'] = True
+                    continue
+            if item['next_try'] > now:
+                wait = min(wait, item['next_try'] - now)
+                continue
+            adapter = remote_registry.get(item['isremote'])
+            remote_wait = adapter.bucket.wait_time()
+            if remote_wait:
+                wait = min(wait, remote_wait)
+                continue
+            # 该远程的并发名额已满，等正在提交的完成
+            if not adapter.slots.acquire(blocking=False):
+                continue
+            try:
+                bot = bot_pool.acquire(ready=lambda bot: self._bot_bucket(bot).wait_time() == 0)
+            except LookupError:
+                adapter.slots.release()
+                return SUBMIT_QUEUE_INTERVAL
+            if bot is None:
+                adapter.slots.release()
+                continue
+            adapter.bucket.take()
+            self._bot_bucket(bot).take()
+            self.inflight.add(runid)
+            adapter.executor.submit(self._submit, item, bot, adapter)
+        return wait
+
+    def _submit(self, item, bot, adapter):
+        runid = item['runid']
         try:
-            with open(token_file, 'r', encoding='utf-8') as f:
-                return yaml.safe_load(f) or []
+            submit_id = submit_to_remote(self.queue, item, bot, adapter)
+        except SubmitRetry as e:
+            item['attempts'] += 1
+            if item['attempts'] >= SUBMIT_MAX_ATTEMPTS:
+                print(f'runid {runid} 提交失败: {str(e)}')
+                set_submission_status(runid, 10)
+                self.queue.done(runid)
+                verdict_cache.settle(runid, None)
+            else:
+                item['next_try'] = time.time() + max(SUBMIT_RETRY_DELAY ** item['attempts'], e.retry_after)
+        except RemoteError as e:
+            # 远程明确拒绝了这次提交
+            print(f'runid {runid} 提交失败: {str(e)}')
+            set_submission_status(runid, 10)
+            self.queue.done(runid)
+            verdict_cache.settle(runid, None)
         except Exception as e:
-            print(f'读取token文件失败: {e}')
-    return []
-
-# 保存token
-def save_tokens(tokens):
-    token_file = os.path.join('tmp', 'token.yml')
+            print(f'runid {runid} 提交结果未知: {str(e)}')
+            set_submission_status(runid, -5)
+            self.queue.done(runid)
+            verdict_cache.settle(runid, None)
+        else:
+            set_submission_status(runid, 5)
+            # 先写入待评测日志再移出提交队列，任何时刻退出都不会丢掉远程 submitId
+            dispatch_poll(PollJob(submit_id, runid, item['pid'], bot, item['author'], item['isremote']))
+            self.queue.done(runid)
+        finally:
+            self.inflight.discard(runid)
+            adapter.slots.release()
 
+def submit_to_remote(queue, item, bot, adapter):
+    payload = adapter.payload(item)
     try:
-        with open(token_file, 'w', encoding='utf-8') as f:
-            yaml.dump(tokens, f, allow_unicode=True)
-        return True
-    except Exception as e:
-        print(f'保存token文件失败: {e}')
-        return False
-
-# 验证token
-def validate_token(token):
-    tokens = load_tokens()
-    current_time = datetime.datetime.now()
-    valid_tokens = []
-    is_valid = False
-    username = None
-    role = None
-
-    for t in tokens:
-        # 检查token是否过期
-        expire_date = datetime.datetime.strptime(t['expire_date'], '%Y-%m-%d %H:%M:%S')
-        if expire_date > current_time:
-            valid_tokens.append(t)
-            # 检查token是否匹配
-            if t['token'] == token:
-                is_valid = True
-                username = t['username']
-                role = t['role']
-
-    # 保存更新后的token列表（移除过期token）
-    save_tokens(valid_tokens)
-    return is_valid, username, role
-def craw_submit(runid, pid, token, author):
-    # 获取远程评测结果
-    config = load_config()
-    # 初始化last_runid
-    if 'last_runid' not in config:
-        config['last_runid'] = 0
-
-    current_runid = config['last_runid'] + 1
-    # 在成功获取数据后更新
-    config['last_runid'] = current_runid
-    save_config(config)
-    while True:
-        api_url = f'{remote_oj}{common_api["GetSubmission"]}?submitId={runid}'
-        headers = common_headers
-        headers['Authorization'] = token
+        # 登录或更新 cfSession 失败时提交还没有发出
+        adapter.prepare(bot)
+    except (RemoteError, requests.ConnectionError) as e:
+        raise SubmitRetry(str(e))
+    queue.sending(item['runid'])
+    try:
+        response = bot.post(common_api[adapter.submit_api], json=payload, prepare=lambda: adapter.prepare(bot))
+    except RemoteError as e:
+        # 提交被 401 拒绝后重新登录或准备失败，提交没有被远程接受
+        queue.unsent(item['runid'])
+        raise SubmitRetry(str(e))
+    except requests.ConnectionError as e:
+        # 连接都没有建立起来时可以安全重试，其他情况（如读超时）无法确认远程是否已收到
+        if request_not_sent(e):
+            queue.unsent(item['runid'])
+            raise SubmitRetry(str(e))
+        raise
+    # 带 Retry-After 的 503 表示远程没有处理这次请求；其他 5xx（如网关超时）时远程可能已经保存了提交，
+    # 重试会重复提交，按结果未知处理
+    if response.status_code == 503 and 'Retry-After' in response.headers:
+        queue.unsent(item['runid'])
         try:
-            response = requests.get(api_url, headers=headers, timeout=10)
-
-            data = response.json()
-            print(data)
-
-            
-            # 解析评测结果
-            submission = data['data']['submission']
-            # 构造YAML条目
-            entry = {
-                'runid': current_runid,
-                'pid': pid,
-                'status': submission['status'],
-                'timems': submission['time'],
-                'memorykb': submission['memory'],
-                # 显示 HOJOJ 用户名
-                'author': author,
-                'language': submission['language'],
-                'score': submission['score'],
-                'code': submission['code'],
-                'createtime': submission['submitTime'].replace('T', ' ')[:19]
-            }
+            retry_after = float(response.headers['Retry-After'])
+        except ValueError:
+            retry_after = 0
+        raise SubmitRetry('HTTP 503', retry_after)
+    if response.status_code >= 500:
+        raise requests.HTTPError(f'HTTP {response.status_code}', response=response)
+    result = response.json()
+    if response.status_code != 200 or result.get('status') != 200:
+        raise RemoteError(result.get('msg', f'HTTP {response.status_code}'))
+    return result['data']['submitId']
 
-            # 加载现有提交记录
-            submission_file = os.path.join('data', 'submission.yml')
-            existing = []
-            if os.path.exists(submission_file):
-                with open(submission_file, 'r') as f:
-                    existing = yaml.safe_load(f) or []
-
-            # 更新或添加记录
-            found = False
-            for idx, item in enumerate(existing):
-                if item['runid'] == current_runid:
-                    if item['status'] in (5,6,7):
-                        existing[idx].update(entry)
-                        found = True
-                    break
+def set_submission_status(runid, status):
+    submission_store.update(runid, {'status': status})
+    status_hub.publish({runid: {'status': status, 'timems': None, 'memorykb': None, 'score': None}})
 
-            if not found:
-                # 添加到最前面
-                existing.insert(0, entry)
+submit_queue = SubmitQueue(SUBMIT_QUEUE)
+verdict_cache = VerdictCache(config.get('verdict_cache_ttl', 600), VERDICT_CACHE_STATS)
+submit_dispatcher = SubmitDispatcher(submit_queue)
 
-            # 没有爬完也要写入
-            with open(submission_file, 'w') as f:
-                yaml.dump(existing, f, allow_unicode=True)
-        except Exception as e:
-            return {'error': f'获取评测结果失败: {str(e)}'}
-        if submission['status'] in (5,6,7):
-            # 保持轮询直到最终状态
-            time.sleep(1)
+# 比赛
+# data/contest.yml 由管理员编辑，每场比赛：cid、title、start/end（'%Y-%m-%d %H:%M:%S'）、rule（icpc / oi）、
+# problems（题号列表）、freeze（结束前封榜的分钟数，可选）、unfreeze（为 true 时解除封榜）。
+# 提交时带 cid 的记录计入比赛。轮询进程在每个最终结果写入后只重算对应的 (用户, 题目) 单元格和所在行，
+# 有变化的比赛每 STANDINGS_INTERVAL 秒最多重新排序一次，带版本号的榜单写到 tmp/standings/，
+# 各进程直接返回缓存的榜单正文，刷新榜单不触发任何计算
+CONTEST_FILE = os.path.join('data', 'contest.yml')
+CONTEST_RELOAD_INTERVAL = 2
+STANDINGS_DIR = os.path.join('tmp', 'standings')
+STANDINGS_INTERVAL = 1
+# ICPC 每次错误提交罚时 20 分钟，编译错误不计
+ICPC_PENALTY_MINUTES = 20
+CONTEST_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def parse_contest_time(value):
+    # yaml 会把不带引号的时间直接解析成 datetime
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return datetime.datetime.strptime(str(value), CONTEST_TIME_FORMAT).timestamp()
+
+def format_contest_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime(CONTEST_TIME_FORMAT)
+
+class ContestCatalog(YamlCollection):
+    # 只读：比赛由管理员直接编辑 contest.yml，各进程按 mtime 重新载入
+    def __init__(self):
+        super().__init__(CONTEST_FILE, os.path.join('tmp', 'contest.lock'))
+
+    def read(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return yaml.safe_load(f) or []
+
+    def build(self, raw):
+        contests = {}
+        for entry in raw:
+            try:
+                cid = str(entry['cid'])
+                start = parse_contest_time(entry['start'])
+                end = parse_contest_time(entry['end'])
+                rule = str(entry.get('rule', 'icpc')).lower()
+                if rule not in ('icpc', 'oi'):
+                    raise ValueError(f'未知赛制 {rule}')
+                freeze = entry.get('freeze')
+                contests[cid] = {
+                    'cid': cid,
+                    'title': entry.get('title', f'比赛 {cid}'),
+                    'start': start,
+                    'end': end,
+                    'rule': rule,
+                    'problems': [str(pid) for pid in entry.get('problems') or []],
+                    # 封榜开始的时刻，不封榜或已解除封榜时为 None
+                    'freeze_at': end - float(freeze) * 60 if freeze and not entry.get('unfreeze') else None
+                }
+            except (KeyError, TypeError, ValueError) as e:
+                print(f'读取比赛 {entry} 失败: {e}')
+        return contests
+
+    def get(self, cid):
+        self.reload_if_changed(CONTEST_RELOAD_INTERVAL)
+        return self.data.get(str(cid))
+
+    def all(self):
+        self.reload_if_changed(CONTEST_RELOAD_INTERVAL)
+        return self.data
+
+def contest_info(contest):
+    now = time.time()
+    return {
+        'cid': contest['cid'],
+        'title': contest['title'],
+        'rule': contest['rule'],
+        'start': format_contest_time(contest['start']),
+        'end': format_contest_time(contest['end']),
+        'freeze': None if contest['freeze_at'] is None else format_contest_time(contest['freeze_at']),
+        'status': 'pending' if now < contest['start'] else 'running' if now < contest['end'] else 'ended',
+        'problems': contest['problems']
+    }
+
+def summarize_cell(events, rule, freeze_at):
+    # events 为按提交时间排序的 (距开赛秒数, runid, 状态, 分数)；freeze_at 及之后的提交只计入 frozen
+    cell = {'attempts': 0, 'first_ac': None, 'penalty': 0, 'score': 0, 'frozen': 0}
+    for t, runid, status, score in events:
+        # ICPC 通过之后的提交不再计入
+        if rule == 'icpc' and cell['first_ac'] is not None:
+            break
+        if freeze_at is not None and t >= freeze_at:
+            cell['frozen'] += 1
+            continue
+        if status == 0 and cell['first_ac'] is None:
+            cell['first_ac'] = t
+            cell['penalty'] = t // 60 + ICPC_PENALTY_MINUTES * cell['attempts']
+        if rule == 'oi':
+            cell['attempts'] += 1
+            cell['score'] = max(cell['score'], score)
+        elif status not in (0, -2):
+            cell['attempts'] += 1
+    return cell
+
+def summarize_row(cells):
+    solved = [cell for cell in cells.values() if cell['first_ac'] is not None]
+    return {
+        'solved': len(solved),
+        'penalty': sum(cell['penalty'] for cell in solved),
+        'score': sum(cell['score'] for cell in cells.values())
+    }
+
+class Standings:
+    # 单场比赛的榜单：full 为真实结果，public 为封榜后对外展示的结果
+    def __init__(self, contest):
+        self.contest = contest
+        # (用户名, 题号) -> 该用户该题按时间排序的最终结果
+        self.events = {}
+        self.seen = set()
+        self.cells = {'full': {}, 'public': {}}
+        self.rows = {'full': {}, 'public': {}}
+        self.published_phase = None
+
+    def phase(self):
+        # 开赛、封榜、结束时即使没有新提交也要重新写出榜单
+        now = time.time()
+        contest = self.contest
+        return (now >= contest['start'], now >= contest['end'],
+                contest['freeze_at'] is not None and now >= contest['freeze_at'])
+
+    def add(self, submission):
+        # 计入一个已出最终结果的比赛提交，返回榜单是否变化
+        contest = self.contest
+        pid = str(submission['pid'])
+        runid = submission['runid']
+        if runid in self.seen or pid not in contest['problems'] or not is_judged(submission['status']):
+            return False
+        t = int(parse_contest_time(submission['createtime']) - contest['start'])
+        if t < 0 or t >= contest['end'] - contest['start']:
+            return False
+        self.seen.add(runid)
+        score = submission.get('score')
+        if score is None:
+            score = 100 if submission['status'] == 0 else 0
+        author = submission['author']
+        events = self.events.setdefault((author, pid), [])
+        bisect.insort(events, (t, runid, submission['status'], score))
+        freeze_at = None if contest['freeze_at'] is None else contest['freeze_at'] - contest['start']
+        for view, cutoff in (('full', None), ('public', freeze_at)):
+            cells = self.cells[view].setdefault(author, {})
+            cells[pid] = summarize_cell(events, contest['rule'], cutoff)
+            self.rows[view][author] = summarize_row(cells)
+        return True
+
+    def render(self, view):
+        contest = self.contest
+        if contest['rule'] == 'icpc':
+            order = lambda row: (-row['solved'], row['penalty'])
         else:
-            # 写入YAML文件
-            with open(submission_file, 'w') as f:
-                yaml.dump(existing, f, allow_unicode=True)
-            # 保存记录
-            user_file = os.path.join('data', 'user.yml')
-            users = []
-            if os.path.exists(user_file):
-                with open(user_file, 'r') as f:
-                    users = yaml.safe_load(f) or []
-            # 查找并更新用户数据
-            for user in users:
-                if user['username'] == author:
-                    user['try'] = user.get('try', 0) + 1
-                    if submission['status'] == 0 and entry['pid'] not in user.get('solve_list', []):
-                        user['solved'] = user.get('solved', 0) + 1
-                        user.setdefault('solve_list', []).append(entry['pid'])
-                    break
-            with open(user_file, 'w') as f:
-                yaml.dump(users, f, allow_unicode=True)
+            order = lambda row: (-row['score'],)
+        rows = sorted(({'username': username, **row, 'cells': self.cells[view][username]}
+                       for username, row in self.rows[view].items()),
+                      key=lambda row: (order(row), row['username']))
+        # 成绩相同的并列
+        previous = None
+        for i, row in enumerate(rows):
+            key = order(row)
+            row['rank'] = rows[i - 1]['rank'] if key == previous else i + 1
+            previous = key
+        frozen = view == 'public' and contest['freeze_at'] is not None and time.time() >= contest['freeze_at']
+        return dict(contest_info(contest), frozen=frozen, rows=rows)
+
+class ContestBoard:
+    # 只在轮询进程中维护，其他进程读取写出的榜单文件
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.standings = {}
+        self.dirty = set()
+
+    def _build(self, contest):
+        standings = Standings(contest)
+        for submission in submission_store.query({'cid': contest['cid']}, count=sys.maxsize):
+            standings.add(submission)
+        return standings
+
+    def record(self, runids):
+        # 最终结果写入存储之后调用，只更新涉及的单元格
+        submissions = [submission_store.get(runid) for runid in runids]
+        with self.lock:
+            for submission in submissions:
+                if not submission or submission.get('cid') is None:
+                    continue
+                standings = self.standings.get(str(submission['cid']))
+                if standings and standings.add(submission):
+                    self.dirty.add(standings.contest['cid'])
+
+    def sync(self):
+        # 比赛新增或修改时从存储重建该场榜单，再写出有变化的榜单
+        contests = contest_catalog.all()
+        with self.lock:
+            for cid in [cid for cid in self.standings if cid not in contests]:
+                del self.standings[cid]
+                for name in (f'{cid}.json', f'{cid}.full.json'):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except OSError:
+                        pass
+            for cid, contest in contests.items():
+                standings = self.standings.get(cid)
+                if standings is None or standings.contest != contest:
+                    standings = self.standings[cid] = self._build(contest)
+                    self.dirty.add(cid)
+                if standings.phase() != standings.published_phase:
+                    self.dirty.add(cid)
+            dirty, self.dirty = self.dirty, set()
+            documents = {}
+            with metrics.timer('hoj_standings_render_seconds'):
+                for cid in dirty:
+                    standings = self.standings[cid]
+                    standings.published_phase = standings.phase()
+                    documents[f'{cid}.json'] = standings.render('public')
+                    documents[f'{cid}.full.json'] = standings.render('full')
+        if not documents:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # 毫秒时间戳作为版本号，轮询进程切换后也不会回退
+        version = time.time_ns() // 1000000
+        for name, document in documents.items():
+            document['version'] = version
+            path = os.path.join(self.directory, name)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(document, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+
+    def run(self):
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                print(f'更新比赛榜单失败: {e}')
+            time.sleep(STANDINGS_INTERVAL)
+
+class StandingsCache:
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        # 文件名 -> (mtime, 正文, ETag)
+        self.entries = {}
+
+    def get(self, cid, full=False):
+        # 返回 (JSON 正文, ETag)；榜单还未生成时抛出 FileNotFoundError
+        name = f'{cid}.full.json' if full else f'{cid}.json'
+        path = os.path.join(self.directory, name)
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None or entry[0] != stat.st_mtime_ns:
+                with open(path, 'rb') as f:
+                    body = f.read()
+                entry = (stat.st_mtime_ns, body, f'{name}-{json.loads(body)["version"]}')
+                self.entries[name] = entry
+            return entry[1], entry[2]
+
+contest_catalog = ContestCatalog()
+contest_board = ContestBoard(STANDINGS_DIR)
+standings_cache = StandingsCache(STANDINGS_DIR)
+
+background_lock = threading.Lock()
+background_started = False
+
+def start_background():
+    # 启动后台线程，每个进程只启动一次
+    global background_started
+    with background_lock:
+        if background_started:
+            return
+        background_started = True
+    threading.Thread(target=persistence.run, daemon=True).start()
+    threading.Thread(target=sweep_tokens, daemon=True).start()
+    threading.Thread(target=problem_catalog.watch, daemon=True).start()
+    threading.Thread(target=problem_search.watch, daemon=True).start()
+    threading.Thread(target=relay_status, daemon=True).start()
+    threading.Thread(target=elect_poller, daemon=True).start()
+    threading.Thread(target=metrics.run, daemon=True).start()
+    threading.Thread(target=snapshots.run, daemon=True).start()
+
+# 队列和连接数只由持有它们的进程报告，合并时不会重复计算
+metrics.gauge('hoj_submit_queue_depth', lambda: len(submit_queue.pending) if is_poller else None)
+metrics.gauge('hoj_poll_pending', lambda: poll_scheduler.pending() if is_poller else None)
+metrics.gauge('hoj_bot_accounts', lambda: bot_pool.count() if is_poller else None)
+metrics.gauge('hoj_sse_watchers', lambda: sum(status_hub.watching.values()))
+
+# 页面缓存
+# web/ 与 problem/*/info.html 读入内存并预先压缩（gzip，装有 brotli 时再加 br），
+# 每秒最多 stat 一次，mtime 或大小变化时重新读取；响应带 ETag / Last-Modified，
+# 浏览器以 no-cache 方式重新验证，未变化时返回 304
+STATIC_CHECK_INTERVAL = 1
+STATIC_MIN_COMPRESS = 512
+
+class StaticCache:
+    def __init__(self):
+        # 路径 -> 缓存项
+        self.entries = {}
+
+    def _load(self, path, stat):
+        with open(path, 'rb') as f:
+            raw = f.read()
+        variants = {'identity': raw}
+        if len(raw) >= STATIC_MIN_COMPRESS:
+            variants['gzip'] = gzip.compress(raw, compresslevel=9, mtime=0)
+            if brotli is not None:
+                variants['br'] = brotli.compress(raw)
+        return {
+            'stat': (stat.st_mtime_ns, stat.st_size),
+            'checked': time.time(),
+            'variants': variants,
+            'etag': hashlib.md5(raw).hexdigest(),
+            'mtime': stat.st_mtime,
+            'mimetype': mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        }
+
+    def get(self, path):
+        entry = self.entries.get(path)
+        if entry is not None and time.time() - entry['checked'] < STATIC_CHECK_INTERVAL:
             return entry
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.entries.pop(path, None)
+            return None
+        if entry is None or entry['stat'] != (stat.st_mtime_ns, stat.st_size):
+            entry = self._load(path, stat)
+        else:
+            entry['checked'] = time.time()
+        self.entries[path] = entry
+        return entry
+
+static_cache = StaticCache()
+
+def send_cached(directory, filename):
+    # 文件不存在时返回 None
+    path = safe_join(directory, filename)
+    entry = static_cache.get(path) if path else None
+    if entry is None:
+        return None
+    encoding = 'identity'
+    for name in ('br', 'gzip'):
+        if name in entry['variants'] and request.accept_encodings[name]:
+            encoding = name
+            break
+    response = app.response_class(entry['variants'][encoding], mimetype=entry['mimetype'])
+    if encoding == 'identity':
+        response.set_etag(entry['etag'])
+    else:
+        # 不同编码的内容不同，ETag 也要区分
+        response.set_etag(f"{entry['etag']}-{encoding}")
+        response.content_encoding = encoding
+    response.last_modified = entry['mtime']
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def send_page(directory, filename):
+    response = send_cached(directory, filename)
+    if response is None:
+        abort(404)
+    return response
+
+# 通知缓存：notice.yml 的 mtime 变化时才重新解析
+NOTICE_FILE = os.path.join(os.path.dirname(__file__), 'data', 'notice.yml')
+
+class NoticeCache:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.body = None
+        self.etag = None
+        self.modified = None
+
+    def get(self):
+        # 返回 (JSON 正文, ETag, 修改时间)；文件不存在或解析失败时抛出异常
+        stat = os.stat(self.path)
+        with self.lock:
+            if stat.st_mtime_ns != self.mtime:
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    notice_data = yaml.safe_load(file)
+                self.body = app.json.dumps(notice_data).encode('utf-8')
+                self.etag = hashlib.md5(self.body).hexdigest()
+                self.modified = stat.st_mtime
+                self.mtime = stat.st_mtime_ns
+            return self.body, self.etag, self.modified
+
+notice_cache = NoticeCache(NOTICE_FILE)
 
 app = Flask(__name__)
+
+@app.before_request
+def ensure_background():
+    # 以 gunicorn run:app 等方式直接加载时，在第一个请求到来时启动后台线程
+    if not background_started:
+        start_background()
+
+@app.before_request
+def start_timer():
+    if metrics.sampled():
+        g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    # 按路由（而不是具体 URL）统计耗时，SSE 只统计到开始推送为止
+    start = g.pop('request_start', None)
+    endpoint = request.endpoint or 'not_found'
+    metrics.inc('hoj_http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+    if start is not None:
+        metrics.observe('hoj_http_request_seconds', time.perf_counter() - start, endpoint=endpoint)
+    return response
+
 # Frontend
 @app.route('/favicon.ico')
 def favicon():
-    return send_from_directory('web', 'favicon.ico')
+    return send_page('web', 'favicon.ico')
 @app.route('/')
 def index():
     return redirect('/home')
 @app.route('/home')
 def home():
-    return send_from_directory('web', 'home.html')
+    return send_page('web', 'home.html')
 @app.route('/problemset')
 def problem():
-    return send_from_directory('web', 'problemset.html')
+    return send_page('web', 'problemset.html')
 @app.route('/problemset/<pid>')
 def problem_detail(pid):
-    problem_dir = os.path.join('problem', pid)
-    info_file = os.path.join(problem_dir, 'info.html')
-    
-    # 检查文件是否存在
-    if os.path.exists(info_file):
-        return send_from_directory(problem_dir, 'info.html')
-    else:
+    problem_dir = safe_join('problem', pid)
+    response = send_cached(problem_dir, 'info.html') if problem_dir else None
+    if response is None:
         return jsonify({'error': '题目不存在'}), 404
+    return response
 @app.route('/submit', methods=['GET'])
 def submit():
-    return send_from_directory('web', 'submit.html')
+    return send_page('web', 'submit.html')
 @app.route('/status', methods=['GET'])
 def status():
-    return send_from_directory('web', 'status.html')
+    return send_page('web', 'status.html')
 @app.route('/status/<int:runid>')
 def status_detail(runid):
-    submission_file = os.path.join('data', 'submission.yml')
-    try:
-        with open(submission_file, 'r') as f:
-            submissions = yaml.safe_load(f) or []
-            submission = next((s for s in submissions if s['runid'] == runid), None)
-            if submission:
-                return send_from_directory('web', 'status_detail.html')
-            return jsonify({'error': '提交记录不存在'}), 404
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    if submission_store.exists(runid):
+        return send_page('web', 'status_detail.html')
+    return jsonify({'error': '提交记录不存在'}), 404
 @app.route('/user/<username>')
 def user_profile(username):
-    return send_from_directory('web', 'user.html')
+    return send_page('web', 'user.html')
 @app.route('/file/<filename>')
 def get_file(filename):
     return send_from_directory('file', filename)
 @app.route('/login')
 def login_frame():
-    return send_from_directory('web', 'login.html')
+    return send_page('web', 'login.html')
 
 # API
 @app.route('/api/login', methods=['POST'])
@@ -307,41 +3483,19 @@ def login():
 
     if not username or not password:
         return jsonify({'msg': '用户名和密码不能为空'}), 400
+    if not isinstance(username, str) or not isinstance(password, str):
+        return jsonify({'msg': '用户名和密码必须是字符串'}), 400
 
-    # 加载用户数据
-    users = load_users()
-
-    is_login = False
     # 验证用户
-    for user in users:
-        if user['username'] == username:
-            if user['password'] == password:
-                is_login = True
-                break
-            else:
-                return jsonify({'msg': '密码错误'}), 401
-    if not is_login:
+    user, is_login = user_index.authenticate(username, password)
+    if user is None:
         return jsonify({'msg': '不存在的用户名'}), 401
+    if not is_login:
+        return jsonify({'msg': '密码错误'}), 401
 
-    # 生成token
-    token, expire_date = generate_token(username)
-
-    # 加载现有token
-    tokens = load_tokens()
-
-    # 移除该用户现有的token（如果有）
-    tokens = [t for t in tokens if t['username'] != username]
-
-    # 添加新token
-    tokens.append({
-        'token': token,
-        'expire_date': expire_date.strftime('%Y-%m-%d %H:%M:%S'),
-        'username': username,
-        'role': user['role']
-    })
-
-    # 保存token
-    if not save_tokens(tokens):
+    # 生成token，同时移除该用户现有的token（如果有）
+    token, expire_date = token_store.issue(username, user['role'])
+    if token is None:
         return jsonify({'msg': '生成token失败'}), 500
     
     # token 应存储在返回的Authorization头中
@@ -365,78 +3519,149 @@ def verify_user():
     else:
         return jsonify({'msg': 'token错误或已过期'}), 401
 
+@app.route('/api/logout', methods=['POST'])
+def logout():
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({'msg': 'token不能为空'}), 400
+    if not token_store.revoke(token):
+        return jsonify({'msg': 'token错误或已过期'}), 401
+    return jsonify({'msg': 'success'}), 200
+
 @app.route('/api/problems', methods=['GET'])
 def get_problems():
-    problem_dir = os.path.join(os.path.dirname(__file__), 'problem')
+    response = app.response_class(problem_catalog.listing, mimetype='application/json')
+    response.set_etag(problem_catalog.etag)
+    return response.make_conditional(request)
+
+@app.route('/api/problems/search', methods=['GET'])
+def search_problems():
+    # 按标题和题面全文搜索，可按 diff / isremote 过滤，默认返回 20 条，最多 100 条
+    query = request.args.get('q', '').strip()
+    filters = {field: request.args[field] for field in ('diff', 'isremote') if request.args.get(field)}
+    count = max(1, min(int(request.args.get('count', 20)), 100))
+    with metrics.timer('hoj_problem_search_seconds'):
+        results = problem_search.search(query, filters)
     problems = []
-    # 遍历problem目录下的所有文件夹
-    for item in os.listdir(problem_dir):
-        item_path = os.path.join(problem_dir, item)
-        # 检查是否是文件夹，且文件夹中包含information.yml
-        if os.path.isdir(item_path) and os.path.exists(os.path.join(item_path, 'information.yml')):
-            # 读取information.yml文件内容
-            info_file_path = os.path.join(item_path, 'information.yml')
-            with open(info_file_path, 'r', encoding='utf-8') as f:
-                # 解析YAML文件
-                info_data = yaml.safe_load(f)
-                
-                # 提取题目信息
-                problem_info = {}
-                for entry in info_data:
-                    for key, value in entry.items():
-                        problem_info[key] = value
-                    
-                # 添加到题目列表
-                problems.append({
-                        'id': str(problem_info['id']),
-                        'title': problem_info.get('name', f'题目 {item}'),
-                        'diff': problem_info.get('diff', '--')
-                })
-        # 按题号排序
-    problems.sort(key=lambda x: int(x['id']))
-    return jsonify(problems), 200
+    for pid, score in results[:count]:
+        info = problem_catalog.get(pid)
+        problems.append({
+            'id': pid,
+            'title': info.get('name', f'题目 {pid}'),
+            'diff': info.get('diff', '--'),
+            'isremote': info.get('isremote'),
+            'score': round(score, 4)
+        })
+    response = jsonify(problems)
+    response.headers['X-Total-Count'] = str(len(results))
+    return response
 
 @app.route('/api/submissions', methods=['GET'])
 def get_submissions():
-    submission_file = os.path.join('data', 'submission.yml')
     # 默认展示数量为最新的 10 条，最多 100 条
     count = int(request.args.get('count', 10))
     if count > 100:
         count = 100
     # 页数，默认第 1 页
     page = int(request.args.get('page', 1))
+    # 按 author / pid / status / language 过滤
+    filters = {field: request.args[field] for field in _QUERY_FIELDS if request.args.get(field)}
+    if 'status' in filters:
+        try:
+            filters['status'] = str(int(filters['status']))
+        except ValueError:
+            return jsonify({'error': 'status 必须是状态码'}), 400
+    # 游标分页：只返回 runid < before 的记录，下一页的游标在 X-Next-Before 中
+    before = request.args.get('before', type=int)
     try:
-        with open(submission_file, 'r', encoding='utf-8') as f:
-            submissions = yaml.safe_load(f) or []
+        if before is None:
             # 分页，跳过 (page-1)*count 条记录
-            submissions = submissions[(page-1)*count:page*count]
-            for sub in submissions:
-                if 'createtime' in sub:
-                    sub['time'] = sub.pop('createtime')
-                if 'status' in sub:
-                    # 保留原始状态码
-                    sub['status_show'] = status_list[sub['status']]
-
-            return jsonify(submissions)
-    except FileNotFoundError:
-        return jsonify({'error': '暂时没有评测记录'}), 404
+            submissions = submission_store.query(filters, count=count, skip=(page - 1) * count)
+        else:
+            submissions = submission_store.query(filters, before=before, count=count)
+        for sub in submissions:
+            if 'createtime' in sub:
+                sub['time'] = sub.pop('createtime')
+            if 'status' in sub:
+                # 保留原始状态码
+                sub['status_show'] = status_list[sub['status']]
+
+        response = jsonify(submissions)
+        if len(submissions) == count:
+            response.headers['X-Next-Before'] = str(submissions[-1]['runid'])
+        return response
     except Exception as e:
         return jsonify({'error': f'读取失败: {str(e)}'}), 500
 
 @app.route('/api/submission/<int:runid>')
 def get_submission(runid):
-    submission_file = os.path.join('data', 'submission.yml')
     try:
-        with open(submission_file, 'r') as f:
-            submissions = yaml.safe_load(f) or []
-            submission = next((s for s in submissions if s['runid'] == runid), None)
+        submission = submission_store.get(runid, code=True)
+        if submission:
             submission['status'] = status_list[submission['status']]
-            if submission:
-                return jsonify(submission)
-            return jsonify({'error': 'Not found'}), 404
+            return jsonify(submission)
+        return jsonify({'error': 'Not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/submission/<int:runid>/events')
+def submission_events(runid):
+    # 以 SSE 推送评测状态变化，到达最终状态或超过 SSE_STREAM_LIFETIME 秒后结束
+    submission = submission_store.get(runid)
+    if submission is None:
+        return jsonify({'error': 'Not found'}), 404
+    if sse_slots is not None and not sse_slots.acquire(blocking=False):
+        response = jsonify({'error': '推送连接已满，请轮询评测状态'})
+        response.headers['Retry-After'] = str(SSE_RETRY_MS // 1000)
+        return response, 503
+    # 起始版本取自本进程，已发布过的状态不会再推送一次
+    version, fields = status_hub.current(runid)
+    if fields is not None:
+        submission = dict(submission, **fields)
+
+    def event(fields):
+        # 事件 id 取状态内容的摘要，重连到任何进程都能判断客户端是否已经收到当前状态
+        payload = {k: fields[k] for k in ('runid', 'status', 'timems', 'memorykb', 'score') if k in fields}
+        payload['status_show'] = status_list[payload['status']]
+        data = json.dumps(payload, ensure_ascii=False)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16], f'data: {data}\n\n'
+
+    def stream(version, submission, last_id):
+        deadline = time.time() + SSE_STREAM_LIFETIME
+        sent, payload = event(submission)
+        yield f'retry: {SSE_RETRY_MS}\n\n'
+        if sent != last_id:
+            yield f'id: {sent}\n{payload}'
+        status = submission['status']
+        status_hub.watch(runid, 1)
+        try:
+            while status in (5,6,7,9):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    # 关闭连接释放线程，客户端按 retry 提示重连
+                    return
+                changed = status_hub.wait(runid, version, min(SSE_KEEPALIVE, remaining))
+                if changed is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                version, fields = changed
+                status = fields['status']
+                # 读取存储和读取版本之间发布的状态可能与已发送的相同
+                event_id, payload = event(fields)
+                if event_id != sent:
+                    sent = event_id
+                    yield f'id: {event_id}\n{payload}'
+        finally:
+            status_hub.watch(runid, -1)
+
+    response = app.response_class(stream(version, submission, request.headers.get('Last-Event-ID')), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    if sse_slots is not None:
+        # 响应结束（包括客户端断开、生成器未开始执行）时归还名额
+        response.call_on_close(sse_slots.release)
+    return response
+
 @app.route('/api/submit', methods=['POST'])
 def submit_problem():
     # 链接 POST 到/submit-remote
@@ -453,168 +3678,127 @@ def submit_problem_judge():
     is_valid, author, role = validate_token(token)
     if not is_valid:
         return jsonify({'msg': '请您先登录！'}), 401
-    # 从对应题目的 information.yml 中获取 isremote 信息
-    problem_dir = os.path.join(os.path.dirname(__file__), 'problem')
-    info_file_path = os.path.join(problem_dir, pid, 'information.yml')
-    with open(info_file_path, 'r', encoding='utf-8') as f:
-        # 解析YAML文件
-        info_data = yaml.safe_load(f)
-        # 提取题目信息
-        problem_info = {}
-        for entry in info_data:
-            for key, value in entry.items():
-                problem_info[key] = value
-        isremote = problem_info['isremote']
-
     if not pid or not code or not lang:
         return jsonify({'msg': 'pid, code, lang不能为空'}), 400
-    if isremote == 'hdu' or isremote == 'poj':
-        if not lang == 'C++' and not lang == 'C++ With O2' and not lang == 'C With O2' and not lang == 'C':
-            return jsonify({'msg': '此题目仅支持C++和C语言'}), 400
-        if lang == 'C++' or lang == 'C++ With O2':
-            lang = 'G++'
-        if lang == 'C With O2' or lang == 'C':
-            lang = 'GCC'
-    if isremote == 'cf':
-        if not lang == 'C++' and not lang == 'C++ 17' and not lang == 'C++ 20' and not lang == 'Python 3' and not lang == 'Java':
-            return jsonify({'msg': '此题目仅支持 C++, C++ 17, C++ 20, Java, Python 语言'}), 400
-        if lang == 'C++' or lang == 'C++ 17':
-            lang = 'GNU G++17'
-        if lang == 'C++ 20':
-            lang = 'GNU G++20'
-        if lang == 'Python 3':
-            lang = 'Python 3.9.1'
-        if lang == 'Java':
-            lang = 'Java 1.8.0_241 '
+    # 比赛中的提交需要在比赛时间内、且题目属于该比赛
+    cid = data.get('cid')
+    if cid is not None:
+        contest = contest_catalog.get(cid)
+        if contest is None:
+            return jsonify({'msg': '比赛不存在'}), 404
+        if not contest['start'] <= time.time() < contest['end']:
+            return jsonify({'msg': '比赛未在进行中'}), 400
+        if str(pid) not in contest['problems']:
+            return jsonify({'msg': '该题目不在比赛中'}), 400
+        cid = contest['cid']
+    # 从题目目录中获取 isremote 信息
+    problem_info = problem_catalog.get(pid)
+    if problem_info is None:
+        return jsonify({'msg': '题目不存在'}), 404
+    isremote = problem_info['isremote']
+    # 按远程适配器的语言表转换语言
+    adapter = remote_registry.get(isremote)
+    remote_lang = adapter.language(lang)
+    if remote_lang is None:
+        return jsonify({'msg': adapter.unsupported}), 400
+    lang = remote_lang
     # 转化 pid
-    problem_dir = os.path.join(os.path.dirname(__file__), 'problem')
-    info_file_path = os.path.join(problem_dir, pid, 'information.yml')
-    with open(info_file_path, 'r', encoding='utf-8') as f:
-        # 解析YAML文件
-        info_data = yaml.safe_load(f)
-        # 提取题目信息
-        problem_info = {}
-        for entry in info_data:
-            for key, value in entry.items():
-                problem_info[key] = value
-        nxt_pid = problem_info['remoteid']
-    # 从用botuser里选择最新的用户
-    botuser_file = os.path.join('data', 'botuser.yml')
-    try:
-        with open(botuser_file, 'r', encoding='utf-8') as f:
-            botuser = yaml.safe_load(f) or []
-    except FileNotFoundError:
+    nxt_pid = problem_info['remoteid']
+    if not bot_pool.count():
         return jsonify({'msg': '未配置远程账户，请联系管理员'}), 403
-    # 判断是否为空
-    if not botuser:
-        return jsonify({'msg': '未配置远程账户，请联系管理员'}), 403
-    # 选择最新的用户
-    remote_username_judge = botuser[0]['username']
-    remote_password_judge = botuser[0]['password']
-    # 将第一项移动到最后防止重复调用
-    botuser.append(botuser.pop(0))
-    # 保存
-    with open(botuser_file, 'w', encoding='utf-8') as f:
-        yaml.dump(botuser, f, allow_unicode=True, default_flow_style=False)
-    # 模拟登录请求
-    login_url = remote_oj + common_api['Login']
-    login_data = {
-        "username": remote_username_judge,
-        "password": remote_password_judge
-    }    
-    headers = common_headers
-    # 从返回中得到令牌
-    try:
-        response = requests.post(login_url, json=login_data, headers=headers)
-        response.raise_for_status()
-        result = response.json()
-        # 请注意无论登录成功与否都会返回 200，需检查 status 字段
-        if result['status'] != 200:
-            return jsonify({'msg': f'登录失败: {result["msg"]}，请联系管理员'}), 400
-        # 从返回的 Header 中得到 token
-        token = response.headers.get("Authorization")
-        if not token:
-            return jsonify({'msg': '登录失败，未返回token，可能是服务器问题'}), 400
-    except Exception as e:
-        return jsonify({'msg': f'登录失败: {str(e)}，请联系管理员'}), 400
-    headers['Authorization'] = token
-    print(f"Token 选择：{token}")
-    target_url = remote_oj + common_api['submitProblem']
-    if isremote == 'cf':
-        update_url = remote_oj + common_api['updcfSession']
-        data = {"cfSession": cf_jsession}
-
-        try:
-            response = requests.post(update_url, json=data, headers=headers)
-            response.raise_for_status()
-            result = response.json()
-            print(result)
-            if response.status_code == 200 and result.get("status") == 200:
-                print(f"CFSession更新:{cf_jsession}")
-            else:
-                return jsonify({'msg': 'CFSession更新失败'}), 400
-        except Exception as e:
-            print(f"未知错误: ")
-            print(response.json())
-            return jsonify({'msg': f'未知错误{str(e)}'}), 400
-
-    payload = {
-        'pid': nxt_pid,
-        'gid': None,
-        'isRemote': (isremote != 'mine'),
-        'code': code,
+    # 通过全部检查后才分配本地 runid，被拒绝的请求不占用编号
+    runid = next_runid()
+    # 写入 Submitting 状态的记录并放入提交队列，由调度线程限速提交到远程
+    submission_store.append({
+        'runid': runid,
+        'pid': pid,
+        'status': 9,
+        'timems': None,
+        'memorykb': None,
+        # 显示 HOJOJ 用户名
+        'author': author,
         'language': lang,
-        'tid': None
-    }
-    response = requests.post(target_url, json=payload, headers=headers)
-    result = response.json()
-    print(result)
-
-    if response.status_code == 200:
-        threading.Thread(target=craw_submit, 
-            args=(result['data']['submitId'], pid, token, author)).start()
-        return jsonify({'msg': 'success'}), 200
-    else:
-        return jsonify({'msg': '提交失败'}), 400
+        # 按语言筛选时使用用户选择的本站语言
+        'submit_language': data.get('lang'),
+        'score': None,
+        'code': code,
+        'cid': cid,
+        'createtime': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    })
+    submit_queue.put({
+        'runid': runid,
+        'pid': pid,
+        'remote_pid': nxt_pid,
+        'isremote': isremote,
+        'lang': lang,
+        'code': code,
+        'author': author,
+        # 管理员可以跳过判定缓存强制重新评测
+        'bypass_cache': bool(data.get('bypass_cache')) and role in ['root', 'admin']
+    })
+    return jsonify({'msg': 'success', 'runid': runid}), 200
 
 @app.route('/api/user/<username>')
 def get_user_data(username):
-    user_file = os.path.join('data', 'user.yml')
-    try:
-        with open(user_file, 'r') as f:
-            users = yaml.safe_load(f) or []
-            user = next((u for u in users if u['username'] == username), None)
-            score_count = 0
-            # 从每个问题的 yml 中依次读取难度分并相加
-            for problem in user['solve_list']:
-                problem_dir = os.path.join(os.path.dirname(__file__), 'problem', problem)
-                info_file_path = os.path.join(problem_dir, 'information.yml')
-                with open(info_file_path, 'r', encoding='utf-8') as f:
-                    info_data = yaml.safe_load(f)
-                    for entry in info_data:
-                        for key, value in entry.items():
-                            if key == 'diff':
-                                score_count += int(value)
-            if user:
-                return jsonify({
-                    'username': user['username'],
-                    'try': user['try'],
-                    'solved': user['solved'],
-                    'solve_list': user['solve_list'],
-                    'score': score_count
-                })
-            return jsonify({'error': '用户不存在'}), 404
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    user = user_index.get(username)
+    if user:
+        return jsonify({
+            'username': user['username'],
+            'try': user['try'],
+            'solved': user['solved'],
+            'solve_list': user['solve_list'],
+            'score': user['score']
+        })
+    return jsonify({'error': '用户不存在'}), 404
+
+@app.route('/api/ranklist', methods=['GET'])
+def get_ranklist():
+    # 默认展示 50 条，最多 100 条
+    count = int(request.args.get('count', 50))
+    if count > 100:
+        count = 100
+    # 页数，默认第 1 页
+    page = int(request.args.get('page', 1))
+    user_index.refresh()
+    with user_index.lock:
+        rows = user_index.ranklist.page(max(page - 1, 0) * count, count)
+        total = user_index.ranklist.size
+    response = jsonify([{
+        'rank': rank,
+        'username': key[3],
+        'score': -key[0],
+        'solved': -key[1],
+        'try': key[2]
+    } for rank, key in rows])
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
+@app.route('/api/ranklist/<username>', methods=['GET'])
+def get_user_rank(username):
+    user_index.refresh()
+    with user_index.lock:
+        rank = user_index.ranklist.rank(username)
+    user = user_index.get(username)
+    if rank is None or user is None:
+        return jsonify({'error': '用户不存在'}), 404
+    return jsonify({
+        'username': username,
+        'rank': rank,
+        'score': user['score'],
+        'solved': user['solved'],
+        'try': user['try']
+    })
 
 @app.route('/api/notice', methods=['GET'])
 def get_notice():
     # 从 /data/notice.yml 中获取通知
-    notice_path = os.path.join(os.path.dirname(__file__), 'data', 'notice.yml')
     try:
-        with open(notice_path, 'r', encoding='utf-8') as file:
-            notice_data = yaml.safe_load(file)
-            return jsonify(notice_data)
+        body, etag, modified = notice_cache.get()
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.last_modified = modified
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
     except FileNotFoundError:
         return jsonify({'error': '通知文件不存在'}), 404
     except yaml.YAMLError as e:
@@ -622,18 +3806,60 @@ def get_notice():
     except Exception as e:
         return jsonify({'error': f'读取通知失败: {str(e)}'}), 500
 
+@app.route('/api/contests', methods=['GET'])
+def get_contests():
+    contests = sorted(contest_catalog.all().values(), key=lambda c: c['start'], reverse=True)
+    return jsonify([contest_info(contest) for contest in contests])
+
+@app.route('/api/contest/<cid>', methods=['GET'])
+def get_contest(cid):
+    contest = contest_catalog.get(cid)
+    if contest is None:
+        return jsonify({'error': '比赛不存在'}), 404
+    info = contest_info(contest)
+    info['problems'] = [{
+        'id': pid,
+        'title': (problem_catalog.get(pid) or {}).get('name', f'题目 {pid}')
+    } for pid in contest['problems']]
+    return jsonify(info)
+
+@app.route('/api/contest/<cid>/standings', methods=['GET'])
+def get_contest_standings(cid):
+    if contest_catalog.get(cid) is None:
+        return jsonify({'error': '比赛不存在'}), 404
+    # 管理员加 full=1 查看封榜期间的真实榜单
+    full = bool(request.args.get('full'))
+    if full:
+        is_valid, username, role = validate_token(request.headers.get('Authorization'))
+        if role not in ['root', 'admin']:
+            return jsonify({'msg': '请重新使用管理员账户登录'}), 403
+    try:
+        body, etag = standings_cache.get(cid, full)
+    except FileNotFoundError:
+        return jsonify({'error': '榜单生成中，请稍后刷新'}), 503
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/about', methods=['GET'])
 def get_about():
-    return jsonify(website_info)
+    response = jsonify(website_info)
+    response.add_etag()
+    return response.make_conditional(request)
 
 # Admin Pages
 @app.route('/admin', methods=['GET'])
 def admin_page():
-    return send_from_directory('web/admin', 'admin.html')
+    return send_page('web/admin', 'admin.html')
 
 @app.route('/admin/users', methods=['GET'])
 def admin_users_page():
-    return send_from_directory('web/admin', 'users.html')
+    return send_page('web/admin', 'users.html')
 
 # Admin API
 @app.route('/api/admin/login', methods=['POST'])
@@ -644,47 +3870,23 @@ def admin_login():
 
     if not username or not password:
         return jsonify({'msg': '用户名和密码不能为空'}), 400
+    if not isinstance(username, str) or not isinstance(password, str):
+        return jsonify({'msg': '用户名和密码必须是字符串'}), 400
 
-    # 加载用户数据
-    users = load_users()
-
-    is_login = False
     # 验证用户
-    for user in users:
-        if user['username'] == username:
-            if user['password'] == password:
-                is_login = True
-                role = user['role']
-                break
-            else:
-                return jsonify({'msg': '密码错误'}), 401
-            
-    if not is_login:
+    user, is_login = user_index.authenticate(username, password)
+    if user is None:
         return jsonify({'msg': '不存在的用户名'}), 401
+    if not is_login:
+        return jsonify({'msg': '密码错误'}), 401
     
      # 检查角色是否为管理员
-    if role not in ['root', 'admin']:
+    if user['role'] not in ['root', 'admin']:
         return jsonify({'msg': '请重新使用管理员账户登录'}), 403
 
-    # 生成token
-    token, expire_date = generate_token(username)
-
-    # 加载现有token
-    tokens = load_tokens()
-
-    # 移除该用户现有的token（如果有）
-    tokens = [t for t in tokens if t['username'] != username]
-
-    # 添加新token
-    tokens.append({
-        'token': token,
-        'expire_date': expire_date.strftime('%Y-%m-%d %H:%M:%S'),
-        'username': username,
-        'role': user['role']
-    })
-
-    # 保存token
-    if not save_tokens(tokens):
+    # 生成token，同时移除该用户现有的token（如果有）
+    token, expire_date = token_store.issue(username, user['role'])
+    if token is None:
         return jsonify({'msg': '生成token失败'}), 500
     
     # token 应存储在返回的Authorization头中
@@ -729,10 +3931,39 @@ def admin_get_users():
     page = int(request.args.get('page', 1))
 
     # 加载用户数据的第 page * count + 1 条记录到第 (page + 1) * count 条记录
-    users = load_users()
-    start_index = (page - 1) * count
-    end_index = page * count
-    return jsonify(users[start_index:end_index]), 200
+    user_index.refresh()
+    # 在锁内取出这一页，其他线程可能同时增删用户
+    with user_index.lock:
+        users = itertools.islice(user_index.users, (page - 1) * count, page * count)
+        # 不返回密码哈希
+        users = [{k: v for k, v in user.items() if k != 'password'} for user in users]
+    return jsonify(users), 200
+
+@app.route('/api/admin/adduser', methods=['POST'])
+def admin_add_user():
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({'msg': 'token不能为空'}), 400
+    # 验证token
+    is_valid, username, role = validate_token(token)
+    if role not in ['root', 'admin']:
+        return jsonify({'msg': '请重新使用管理员账户登录'}), 403
+
+    data = request.json
+    new_username = data.get('username')
+    password = data.get('password')
+    new_role = data.get('role', 'user')
+    if not new_username or not password:
+        return jsonify({'msg': '用户名和密码不能为空'}), 400
+    if not isinstance(new_username, str) or not isinstance(password, str):
+        return jsonify({'msg': '用户名和密码必须是字符串'}), 400
+    # 只有 root 可以添加管理员
+    if new_role not in ['user', 'admin'] or (new_role == 'admin' and role != 'root'):
+        return jsonify({'msg': '无效的角色'}), 400
+    user = user_index.add(new_username, password, new_role)
+    if user is None:
+        return jsonify({'msg': '用户名已存在'}), 400
+    return jsonify({'msg': 'success', 'uid': user['uid']}), 200
 
 
 @app.route('/api/admin/deleteuser', methods=['DELETE'])
@@ -749,29 +3980,94 @@ def admin_delete_user():
     uid = data.get('uid')
     if not uid:
         return jsonify({'msg': 'uid不能为空'}), 400
-    # 加载用户数据
-    users = load_users()
-    # 二分查找 UID
-    left, right = 0, len(users) - 1
-    found = False
-    while left <= right:
-        mid = (left + right) // 2
-        if int(users[mid]['uid']) == int(uid):
-            found = True
-            break
-        elif int(users[mid]['uid']) < int(uid):
-            left = mid + 1
-        else:
-            right = mid - 1
-    if not found:
-        return jsonify({'msg': '不存在的uid'}), 400
     # 删除用户
-    del users[mid]
-    # 保存用户数据
-    if not save_users(users):
-        return jsonify({'msg': '删除用户失败'}), 500
+    if user_index.delete_uid(uid) is None:
+        return jsonify({'msg': '不存在的uid'}), 400
     return jsonify({'msg': 'success'}), 200
 
+@app.route('/api/admin/rebuild-stats', methods=['POST'])
+def admin_rebuild_stats():
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({'msg': 'token不能为空'}), 400
+    # 验证token
+    is_valid, username, role = validate_token(token)
+    if role not in ['root', 'admin']:
+        return jsonify({'msg': '请重新使用管理员账户登录'}), 403
+    count = user_index.rebuild(submission_store.scan())
+    return jsonify({'msg': 'success', 'users': count}), 200
+
+@app.route('/api/admin/verdict-cache', methods=['GET'])
+def admin_verdict_cache():
+    token = request.headers.get('Authorization')
+    if not token:
+        return jsonify({'msg': 'token不能为空'}), 400
+    # 验证token
+    is_valid, username, role = validate_token(token)
+    if role not in ['root', 'admin']:
+        return jsonify({'msg': '请重新使用管理员账户登录'}), 403
+    try:
+        with open(VERDICT_CACHE_STATS, 'r', encoding='utf-8') as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        stats = verdict_cache.summary()
+    return jsonify(stats), 200
+
+
+def serve(host, port, workers, threads):
+    # 生产模式：gunicorn 多进程 + 每进程多线程
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print('生产模式需要安装 gunicorn: pip install gunicorn')
+        sys.exit(1)
+
+    class HOJOJApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            # SSE 长连接需要线程型 worker
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('post_worker_init', self.init_worker)
+            self.cfg.set('worker_exit', lambda server, worker: sys.modules['run'].snapshots.save())
+
+        @staticmethod
+        def init_worker(worker):
+            sys.modules['run'].limit_sse_streams(threads)
+            sys.modules['run'].start_background()
+
+        def load(self):
+            # 每个 worker 重新导入 run，使用各自的文件句柄和后台线程
+            import importlib
+            return importlib.import_module('run').app
+
+    HOJOJApplication().run()
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=8080)
+    parser = argparse.ArgumentParser(description='HOJOJ')
+    parser.add_argument('command', nargs='?', default='dev', choices=['dev', 'serve', 'rebuild-stats', 'hash-passwords', 'export-submissions'],
+                        help='dev: Flask 开发服务器；serve: 生产模式；rebuild-stats: 根据评测记录重建用户统计；'
+                             'hash-passwords: 把 user.yml 中的明文密码升级为哈希；'
+                             'export-submissions: 把全部评测记录（含代码）导出为 data/submission.yml')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+    if args.command == 'rebuild-stats':
+        print(f'已重建 {user_index.rebuild(submission_store.scan())} 个用户的统计')
+    elif args.command == 'hash-passwords':
+        print(f'已升级 {user_index.hash_all_passwords()} 个用户的密码')
+    elif args.command == 'export-submissions':
+        # 导出的文件可以在空的数据目录中由启动时的迁移重新导入
+        submissions = [submission_store.get(runid, code=True) for runid in list(submission_store.runids)]
+        atomic_dump_yaml(SUBMISSION_YML, submissions)
+        print(f'已导出 {len(submissions)} 条评测记录到 {SUBMISSION_YML}')
+    elif args.command == 'serve':
+        serve(args.host, args.port, args.workers, args.threads)
+    else:
+        # 开发服务器的重载器会启动两个进程，只在真正处理请求的子进程中启动后台线程
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_background()
+        app.run(debug=True, host=args.host, port=args.port)